@@ -1,7 +1,6 @@
-import os, sys, argparse, json, copy, traceback, glob
-import numpy as np
+import os, sys, argparse, json, struct, copy, traceback, glob, fnmatch, math, re, hashlib, base64, mimetypes, gzip, bz2, lzma, zlib, pickle, time, select, numbers, heapq, contextlib, contextvars, functools
 from datetime import datetime
-from monty.serialization import loadfn, dumpfn
+from html import escape
 
 HTML_HEAD = """
 <html>
@@ -101,34 +100,442 @@ HTML_HEAD = """
             object-fit: contain;
             cursor: zoom-out;
         }
+
+        .plot {
+            display: inline-block;
+            margin: 4px;
+            vertical-align: top;
+        }
     </style>
 </head>
 """
 
-def _init():
-    global _global_dict
-    _global_dict = {"START_TIME": datetime.now()}
+class ReportContext:
+    '''
+    The state of building one report: the settings (values, version, job address, the directory of version.dat),
+    the time spent in each stage, and the caches. The current context is kept in a context variable, so that
+    the reports built concurrently in different threads (see build_report()) do not share any state.
+    version: the version shown in the report, read from version.dat in workdir if None
+    thumbnails: the directory of the thumbnails of the images (see make_thumbnail()), None to show the images as they are
+    precision: {column name pattern: format spec} of the numbers in the tables, see column_format()
+    profiler: a StageProfiler to profile each stage, None to only time them
+    '''
+    def __init__(self, version: str = None, job_address: str = "", workdir: str = ".", thumbnails: str = None, precision: dict = None,
+                 profiler: "StageProfiler" = None, **values):
+        self.values = {"START_TIME": datetime.now(), "JOB_ADDRESS": job_address}
+        self.values.update(values)
+        self.version = version
+        self.workdir = workdir
+        self.thumbnails = thumbnails
+        self.precision = dict(precision or {})
+        self.profiler = profiler
+        self.timings = {}   # {stage: seconds}
+        self.caches = {}    # {name: dict}, e.g. the assets read by bundle_html()
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        # accumulate the time spent in a stage, the stage is also profiled if there is a profiler
+        if self.profiler:
+            self.profiler.enter(stage)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - t0
+            if self.profiler:
+                self.profiler.exit()
+
+    def cache(self, name: str) -> dict:
+        return self.caches.setdefault(name, {})
+
+_CONTEXT = contextvars.ContextVar("report_context")
+
+def current_context() -> ReportContext:
+    try:
+        return _CONTEXT.get()
+    except LookupError:
+        return _init()
+
+def stage(func):
+    # time each call of func as a stage named by the function, see ReportContext.timer()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with current_context().timer(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+class StageProfiler:
+    '''
+    Profile the stages of building a report (see ReportContext.timer()) by cProfile, and by tracemalloc if memory is True.
+    The stages may be nested, the time of an inner stage is not counted in the outer one. The memory is only traced
+    in the first call of each stage (and the stages in it), as tracing and comparing the snapshots of all the memory
+    is slow: the peak memory and the allocations still alive at the end of the first call are reported.
+    dump() writes into a directory:
+    - STAGE.prof: the cProfile stats of each stage, STAGE is the path of the nested stages joined by ".",
+      which can be read by pstats or snakeviz
+    - profile.collapsed: the collapsed stacks of all stages in microseconds, for flamegraph.pl, inferno or speedscope
+    - allocations.txt: the calls, time and peak memory of each stage, and the top allocations of each stage
+    '''
+    def __init__(self, memory: bool = True, top: int = None):
+        self.memory = memory
+        self.top = top or PROFILE_TOP_ALLOCATIONS
+        self.profiles = {}  # {stage path: cProfile.Profile}
+        self.stats = {}     # {stage path: {"calls": n, "time": seconds, "peak": bytes, "allocations": {line: [bytes, blocks]}}}
+        self.stack = []     # [[stage path, start time, start memory, peak memory, snapshot]] of the running stages,
+                            # the memory is None if not traced, the snapshot is True if the tracing is started by the stage
+
+    def enter(self, stage: str):
+        import cProfile, tracemalloc
+        if self.stack:
+            self.profiles[self.stack[-1][0]].disable()
+        path = (self.stack[-1][0] if self.stack else ()) + (stage,)
+        memory, snapshot = None, None
+        if self.memory and path not in self.stats and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            snapshot = True
+        elif tracemalloc.is_tracing() and path not in self.stats:
+            snapshot = tracemalloc.take_snapshot()
+        if tracemalloc.is_tracing():
+            memory, peak = tracemalloc.get_traced_memory()
+            if self.stack and self.stack[-1][3] is not None:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+            tracemalloc.reset_peak()
+        self.stack.append([path, time.perf_counter(), memory, memory, snapshot])
+        self.profiles.setdefault(path, cProfile.Profile()).enable()
+
+    def exit(self):
+        import tracemalloc
+        path, t0, memory, peak, snapshot = self.stack.pop()
+        self.profiles[path].disable()
+        stats = self.stats.setdefault(path, {"calls": 0, "time": 0.0, "peak": 0, "allocations": {}})
+        stats["calls"] += 1
+        stats["time"] += time.perf_counter() - t0
+        if memory is not None:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            stats["peak"] = max(stats["peak"], peak - memory)
+            if snapshot is True:
+                # all traces are allocated in this stage
+                diffs = [(s.traceback, s.size, s.count) for s in tracemalloc.take_snapshot().statistics("lineno")]
+                tracemalloc.stop()
+            elif snapshot is not None:
+                diffs = [(s.traceback, s.size_diff, s.count_diff) for s in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")]
+            else:
+                diffs = []
+            for traceback_, size, count in diffs:
+                if size > 0:
+                    stats["allocations"][str(traceback_[0])] = [size, count]
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            if self.stack and self.stack[-1][3] is not None:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+        if self.stack:
+            self.profiles[self.stack[-1][0]].enable()
+
+    def collapsed_stacks(self) -> dict:
+        '''
+        Return {collapsed stack: microseconds}. cProfile only records the callers of each function, so the time of
+        a function is split among its call paths in proportion to the time of each caller-callee edge.
+        '''
+        import pstats
+        stacks = {}
+        for path, profile in self.profiles.items():
+            stats = pstats.Stats(profile).stats  # {func: (primitive calls, calls, self time, cumulative time, {caller: edge})}
+            callees = {}
+            for func, (_, _, _, _, callers) in stats.items():
+                for caller, edge in callers.items():
+                    callees.setdefault(caller, []).append((func, edge[3]))
+
+            def walk(func, frames, share):
+                frames = frames + [_frame_name(func)]
+                self_time = stats[func][2]
+                if self_time * share >= 1e-6:
+                    key = ";".join(frames)
+                    stacks[key] = stacks.get(key, 0) + self_time * share * 1e6
+                if len(frames) >= PROFILE_MAX_DEPTH:
+                    return
+                for callee, edge_time in callees.get(func, []):
+                    callee_total = stats[callee][3]
+                    if callee_total > 0 and share * edge_time >= 1e-6 and _frame_name(callee) not in frames:
+                        walk(callee, frames, share * edge_time / callee_total)
+
+            prefix = ["stage " + s for s in path]
+            for func, (_, _, _, _, callers) in stats.items():
+                if not callers:
+                    walk(func, prefix, 1.0)
+        return {k: int(round(v)) for k, v in stacks.items() if round(v) > 0}
+
+    def dump(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for path, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, ".".join(path) + ".prof"))
+        with open(os.path.join(directory, "profile.collapsed"), "w") as f:
+            for stack, us in sorted(self.collapsed_stacks().items()):
+                f.write(f"{stack} {us}\n")
+
+        with open(os.path.join(directory, "allocations.txt"), "w") as f:
+            f.write(f"{'stage':<50} {'calls':>8} {'time(s)':>10} {'peak(MiB)':>10}   (the memory of the first call)\n")
+            for path, stats in self.stats.items():
+                f.write(f"{';'.join(path):<50} {stats['calls']:>8} {stats['time']:>10.3f} {stats['peak'] / 2**20:>10.2f}\n")
+            for path, stats in self.stats.items():
+                if not stats["allocations"]:
+                    continue
+                f.write(f"\nTop allocations of {';'.join(path)} (alive at the end of the first call):\n")
+                top = sorted(stats["allocations"].items(), key=lambda x: -x[1][0])[:self.top]
+                for line, (size, count) in top:
+                    f.write(f"{size / 2**10:>12.1f} KiB {count:>10} blocks  {line}\n")
+        print(f"The profile of the stages is written to {directory}")
+
+def _frame_name(func: tuple) -> str:
+    # the frame of a function in the collapsed stacks, func is (file name, line number, function name) of pstats
+    filename, lineno, name = func
+    frame = name if filename == "~" else f"{name} ({os.path.basename(filename)}:{lineno})"
+    return frame.replace(";", ",")
+
+def _init(context: ReportContext = None) -> ReportContext:
+    # start a new report in the current context
+    context = context or ReportContext()
+    _CONTEXT.set(context)
+    return context
 
 def set_value(key, value):
-    if key in _global_dict:
-        print("WARNING: key %s has been used, the value will be modified from '" % key,_global_dict[key],"' to '",value,"'")
-    _global_dict[key] = value
+    values = current_context().values
+    if key in values:
+        print("WARNING: key %s has been used, the value will be modified from '" % key,values[key],"' to '",value,"'")
+    values[key] = value
 
 def get_value(key,defValue=None):
-    return _global_dict.get(key,defValue)
+    return current_context().values.get(key,defValue)
+
+def _column_kind(values):
+    '''
+    The kind of a column: "num" if all values are numbers or None, "str" if all values are str or None,
+    "empty" if all values are None, else "mixed"
+    '''
+    kind = "empty"
+    for v in values:
+        if v is None:
+            continue
+        # the exact types are checked first, isinstance() of numbers.Real is much slower
+        ikind = "num" if type(v) is float or type(v) is int or isinstance(v, numbers.Real) and not isinstance(v, bool) else "str" if isinstance(v, str) else "mixed"
+        if kind == "empty":
+            kind = ikind
+        elif kind != ikind:
+            return "mixed"
+    return kind
+
+class Table:
+    '''
+    A columnar table. header is the list of column names, and columns holds the raw values of each column.
+    The values are kept as they are (numbers stay numbers) until the table is rendered by _table2html().
+    select(), take() and transpose() return views that refer to this table without copying the values.
+    '''
+    __slots__ = ("header", "columns", "kinds", "_pos")
+
+    def __init__(self, header, columns):
+        self.header = list(header)
+        self.columns = columns
+        self.kinds = [None] * len(self.header)
+        self._pos = {}
+        for i, h in enumerate(self.header):
+            self._pos.setdefault(h, i)
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''
+        Build a table from a list of rows, the first row is the head. Short rows are filled with "".
+        '''
+        if not rows:
+            return cls([], [])
+        ncols = max(len(r) for r in rows)
+        rows = [list(r) + [""] * (ncols - len(r)) for r in rows]
+        return cls(rows[0], [list(c) for c in zip(*rows[1:])] if len(rows) > 1 else [[] for _ in range(ncols)])
+
+    @classmethod
+    def from_records(cls, values, first="example"):
+        '''
+        Build a table from {example: {metric: value}}, the metrics are ordered by their first appearance
+        '''
+        metrics = {}
+        for v in values.values():
+            metrics.update(dict.fromkeys(v))
+        columns = [list(values.keys())] + [[v.get(imetric,None) for v in values.values()] for imetric in metrics]
+        return cls([first] + list(metrics), columns)
+
+    @property
+    def nrows(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    @property
+    def ncols(self):
+        return len(self.header)
+
+    def index(self, name):
+        return self._pos.get(name)
+
+    def cell(self, i, j):
+        return self.columns[j][i]
+
+    def kind(self, j):
+        if self.kinds[j] is None:
+            self.kinds[j] = _column_kind(self.column(j))
+        return self.kinds[j]
+
+    def column(self, key):
+        # the values of a column, key is the column name or index. The stored column is returned without copying,
+        # it must not be modified
+        j = key if isinstance(key, int) else self.index(key)
+        if self.columns is not None:
+            return self.columns[j]
+        return [self.cell(i, j) for i in range(self.nrows)]
+
+    def rows(self):
+        for i in range(self.nrows):
+            yield [self.cell(i, j) for j in range(self.ncols)]
+
+    def to_rows(self):
+        return [list(self.header)] + list(self.rows())
+
+    def select(self, names):
+        '''
+        A view of the columns in names, a name not in the table gives a column of None
+        '''
+        return TableView(self, names, [self.index(name) for name in names])
+
+    def sort_permutation(self, keys):
+        '''
+        The row order that sorts the table by the columns in keys, None if a key is not a column
+        '''
+        idx = []
+        for key in keys:
+            if self.index(key) is None:
+                print("sort ERROR:",key,"is not a head of input table. Table head is:",self.header)
+                return None
+            idx.append(self.index(key))
+        sort_columns = [self.column(j) for j in idx]
+        return sorted(range(self.nrows), key=lambda i: [c[i] for c in sort_columns])
+
+    def take(self, perm):
+        # a view of the rows in the order of perm
+        return TableView(self, self.header, list(range(self.ncols)), perm)
+
+    def transpose(self):
+        return TransposedTable(self)
+
+class TableView(Table):
+    '''
+    A view of selected columns (cols, None for a missing column) of base in the row order perm.
+    format_table() attaches the pass/fail marks of the criteria to it, which are used by _table2html().
+    '''
+    __slots__ = ("base", "cols", "perm", "marks", "color")
+
+    def __init__(self, base, header, cols, perm=None):
+        self.base = base
+        self.cols = cols
+        self.perm = perm
+        self.marks = {}
+        self.color = {True:"green",False:"red"}
+        Table.__init__(self, header, None)
+
+    @property
+    def nrows(self):
+        return self.base.nrows if self.perm is None else len(self.perm)
+
+    def cell(self, i, j):
+        c = self.cols[j]
+        if c is None:
+            return None
+        return self.base.cell(i if self.perm is None else self.perm[i], c)
 
-def csv2table(csvfile):
+    def kind(self, j):
+        # the kind of a column does not depend on the order of the rows, it is cached by base
+        c = self.cols[j]
+        return "empty" if c is None else self.base.kind(c)
+
+    def column(self, key):
+        # the whole column is taken from base at once, a new list is built only if the rows are permuted
+        j = key if isinstance(key, int) else self.index(key)
+        c = self.cols[j]
+        if c is None:
+            return [None] * self.nrows
+        values = self.base.column(c)
+        return values if self.perm is None else [values[i] for i in self.perm]
+
+class TransposedTable(Table):
+    '''
+    The transposed view of base, the head of base becomes the first column
+    '''
+    __slots__ = ("base",)
+
+    def __init__(self, base):
+        self.base = base
+        Table.__init__(self, [base.header[0], *base.column(0)], None)
+
+    @property
+    def nrows(self):
+        return self.base.ncols - 1
+
+    def cell(self, i, j):
+        return self.base.header[i + 1] if j == 0 else self.base.cell(j - 1, i + 1)
+
+def as_table(table):
+    # accept both a Table and a list of rows with the head as the first row
+    if isinstance(table, Table):
+        return table
+    return Table.from_rows(table)
+
+def read_csv(csvfile, head=None, tail=0):
+    '''
+    Read a csv file row by row, only the first head rows (all rows if head is None) and the last tail rows are kept,
+    so that a large file is never read into memory as a whole.
+    Return (header, head_rows, tail_rows, nrows), nrows is the number of all rows without the header.
+    '''
+    import csv
+    from collections import deque
+    head_rows, tail_rows, nrows = [], deque(maxlen=tail or 0), 0
+    with open(csvfile, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        for row in reader:
+            if not row:
+                continue
+            if head is None or nrows < head:
+                head_rows.append(row)
+            elif tail:
+                tail_rows.append(row)
+            nrows += 1
+    return header, head_rows, list(tail_rows), nrows
+
+def _parse_numbers(values):
+    '''
+    Convert a column of csv fields to numbers if all the non-empty fields are numbers, the empty fields become None.
+    Otherwise the fields are kept as they are.
+    '''
+    numbers_list = []
+    for v in values:
+        v = v.strip()
+        if v == "":
+            numbers_list.append(None)
+            continue
+        try:
+            numbers_list.append(int(v) if re.fullmatch(r"[+-]?\d+", v) else float(v))
+        except ValueError:
+            return list(values)
+    return numbers_list if any(v is not None for v in numbers_list) else list(values)
+
+def csv2table(csvfile, head=None, tail=0):
     '''
-    Transform a csv file to a table
+    Transform a csv file to a table, the numeric columns are converted to numbers.
+    head and tail: only the first head rows and the last tail rows are read, see read_csv()
     '''
     if not os.path.exists(csvfile):
         print(f"Error: {csvfile} does not exist!")
-        return []
-    with open(csvfile) as f:
-        lines = f.readlines()
-        table = []
-        for line in lines:
-            table.append(line.strip().split(","))
+        return Table([], [])
+    header, head_rows, tail_rows, _ = read_csv(csvfile, head, tail)
+    return _csv_rows2table(header, head_rows + tail_rows)
+
+def _csv_rows2table(header, rows):
+    table = Table.from_rows([header] + rows)
+    table.columns = [_parse_numbers(c) for c in table.columns]
     return table
 
 def dict2table(values):
@@ -137,18 +544,7 @@ def dict2table(values):
     The key should be the first column that is the example name, and the value should be a dict, which are the other columns, and the keys are the metric name.
     
     '''
-    table = []
-    metrics = []
-    for k,v in values.items():
-        for ik in v.keys():
-            if ik not in metrics:
-                metrics.append(ik)
-
-    table.append(["example"] + metrics)
-    for ikey in values.keys():
-        table.append([ikey] + [values[ikey].get(imetric,None) for imetric in metrics])
-    
-    return table
+    return Table.from_records(values)
 
 def json2table(jsonfile):
     '''
@@ -158,20 +554,10 @@ def json2table(jsonfile):
     '''
     if not os.path.exists(jsonfile):
         print(f"Error: {jsonfile} does not exist!")
-        return []
-    values = json.load(open(jsonfile))
-    table = []
-    metrics = []
-    for k,v in values.items():
-        for ik in v.keys():
-            if ik not in metrics:
-                metrics.append(ik)
-
-    table.append(["example"] + metrics)
-    for ikey in values.keys():
-        table.append([ikey] + [values[ikey].get(imetric,None) for imetric in metrics])
-    
-    return table
+        return Table([], [])
+    with open(jsonfile) as f:
+        values = json.load(f)
+    return Table.from_records(values)
 
 def json2table_sm(jsonfile):
     '''
@@ -219,28 +605,25 @@ def file2table(metricfile):
 
 def rotate_table(table):
     '''
-    Rotate a table
+    Rotate a table, a Table gives a transposed view and a list of rows gives a new list of rows
     '''
+    if isinstance(table, Table):
+        return table.transpose()
     new_table = []
     for i in range(len(table[0])):
         new_table.append([table[j][i] for j in range(len(table))])
     return new_table
 
 def isort(itable_input,head_list):
-    itable = copy.deepcopy(itable_input)
-    heads = copy.deepcopy(itable[0])
-    sort_idx = []
-    for i in head_list:
-        if i not in heads:
-            print("isort() ERROR:",i,"is not a head of input table. Table head is:",heads)
-            return itable
-        else:
-            sort_idx.append(heads.index(i))
-    jtable = []
-    for i in itable[1:]:
-        jtable.append([i[j] for j in sort_idx] + [i])
-    jtable.sort()
-    return [heads] + [i[-1] for i in jtable]
+    '''
+    Sort a table by the columns in head_list, a Table gives a sorted view and a list of rows gives a new list of rows
+    '''
+    itable = as_table(itable_input)
+    perm = itable.sort_permutation(head_list)
+    if perm is None:
+        return itable_input if isinstance(itable_input, Table) else copy.deepcopy(itable_input)
+    view = itable.take(perm)
+    return view if isinstance(itable_input, Table) else view.to_rows()
 
 def output_float(f, prec=4):
     '''
@@ -264,6 +647,55 @@ def output_float(f, prec=4):
     else:
         return '%.*f' % (prec, f)
     
+def format_column(values, kind=None, spec=None):
+    '''
+    Format a column of values to str as output_float() does, but the kind of the column (see _column_kind())
+    is checked only once, and the numbers of a numeric column are formatted without checking each of them.
+    spec: the number of decimals (default 4), or "Ng" for N significant figures
+    '''
+    kind = kind or _column_kind(values)
+    prec, sig = 4, None
+    if isinstance(spec, str) and spec.endswith("g"):
+        sig = int(spec[:-1])
+    elif spec is not None:
+        prec = int(spec)
+    if sig is not None:
+        fmt_float = lambda f: '%.*g' % (sig, f)
+    else:
+        small = pow(10, -1*prec)
+        fmt_float = lambda f: '%.2e' % f if abs(f) < small else '%.*f' % (prec, f)
+
+    if kind == "num":
+        if sig is None:
+            # inlined fmt_float(), a function call per value costs as much as the formatting
+            return ["---" if v is None else str(v) if isinstance(v, int) else '%.2e' % v if abs(v) < small else '%.*f' % (prec, v) for v in values]
+        return ["---" if v is None else str(v) if isinstance(v, int) else fmt_float(v) for v in values]
+    elif kind == "str":
+        return ["---" if v is None else v for v in values]
+    elif kind == "empty":
+        return ["---"] * len(values)
+    # a mixed column, each value is checked as output_float() does
+    column = []
+    for v in values:
+        if v is None or isinstance(v, (str, int)):
+            column.append(output_float(v))
+            continue
+        try:
+            column.append(fmt_float(float(v)))
+        except (TypeError, ValueError):
+            column.append(str(v))
+    return column
+
+def column_format(name: str):
+    '''
+    The format spec of a column for format_column(), the first pattern of the report context (see --precision)
+    matching the column name, or None for the default
+    '''
+    for pattern, spec in current_context().precision.items():
+        if fnmatch.fnmatchcase(str(name), pattern):
+            return spec
+    return None
+
 def judge_metric(x, criteria):
     '''
     Judge if a metric is good or bad based on criteria
@@ -275,9 +707,10 @@ def judge_metric(x, criteria):
     except:
         return None
     
+@stage
 def format_table(table,metrics_name=None, sort=None, criteria=None, color={True:"green",False:"red"}):
     '''
-    table: a list of list, each list is a row of the table. The first row is the head of the table
+    table: a Table, or a list of list, each list is a row of the table. The first row is the head of the table
     metrics_name: a list of metrics name, which will be output in the table
     sort: a list of metrics name, which will be used to sort the table
     criteria: a dict of criteria, the key is the metric name, and the value is the criteria
@@ -286,6 +719,8 @@ def format_table(table,metrics_name=None, sort=None, criteria=None, color={True:
     1. If the value is a number, then round it to 4 digits
     2. If the value pass the criteria, the value will be colored to green, else red.
     3. If the value is None, then transfer to "---"
+    The values are not changed, the pass/fail of each value is attached to the returned view, 
+    and the rounding and coloring are done when the view is rendered by _table2html().
     
     criteria is a dict:
     {
@@ -293,57 +728,48 @@ def format_table(table,metrics_name=None, sort=None, criteria=None, color={True:
         "criteria": "x > 0"   # this is a string, should be evaluated by python
     }
     
-    return a table, and a dict of pass number
+    return a TableView, and a dict of pass number
     {
         "key_metrics": {"pass": 1, "notpass": 2},
         "all": {"pass": 3, "total": 4}
     }
     '''
-    # print("criteria:",criteria)
-    # print("table head:",table[0])
+    table = as_table(table)
+    if criteria is None:
+        criteria = {}
     
     if metrics_name in [[],None]:
-        metrics_name = table[0]
-    if table[0][0] not in metrics_name:
-        metrics_name = [table[0][0]] + metrics_name # the first colume should be the example name
-    
-    metric_idx = []
-    for i in metrics_name:
-        if i not in table[0]:
-            metric_idx.append(None)
-        else:
-            metric_idx.append(table[0].index(i))
-    
-    new_table = [metrics_name]
-    for i in range(1,len(table)):
-        new_table.append([None if j == None else table[i][j] for j in metric_idx])
+        metrics_name = table.header
+    if table.header[0] not in metrics_name:
+        metrics_name = [table.header[0]] + metrics_name # the first colume should be the example name
     
+    view = table.select(metrics_name)
     if sort:
-        new_table = isort(new_table,sort)    
-    table = new_table
+        perm = view.sort_permutation(sort)
+        if perm is not None:
+            view = view.take(perm)
         
     pass_num = {k:{"pass":0,"notpass":0} for k in criteria.keys()}
-    pass_num["all"] = {"pass":0,"total":len(table)-1}
-    for i in range(1,len(table)):
-        allpass = True
-        for j in range(len(table[i])):
-            metric_name = table[0][j]
-            if metric_name in criteria:
-                metric_pass = judge_metric(table[i][j], criteria[metric_name])
-                if metric_pass == True:
-                    table[i][j] = '<font color="%s">%s</font>' % (color[True], output_float(table[i][j]))
-                    pass_num[metric_name]["pass"] += 1
-                else:
-                    table[i][j] = '<font color="%s">%s</font>' % (color[False], output_float(table[i][j]))
-                    if metric_pass == False:
-                        pass_num[metric_name]["notpass"] += 1
-                    allpass = False
+    pass_num["all"] = {"pass":0,"total":view.nrows}
+    allpass = [True] * view.nrows
+    for j, metric_name in enumerate(view.header):
+        if metric_name not in criteria:
+            continue
+        marks = []
+        for i, value in enumerate(view.column(j)):
+            metric_pass = judge_metric(value, criteria[metric_name])
+            marks.append(metric_pass)
+            if metric_pass == True:
+                pass_num[metric_name]["pass"] += 1
             else:
-                table[i][j] = output_float(table[i][j])
-        if allpass:
-            pass_num["all"]["pass"] += 1
+                if metric_pass == False:
+                    pass_num[metric_name]["notpass"] += 1
+                allpass[i] = False
+        view.marks[j] = marks
+    view.color = color
+    pass_num["all"]["pass"] = sum(allpass)
                     
-    return table, pass_num
+    return view, pass_num
 
 def gen_criteria(criteria,pass_num):
     html =  f'''
@@ -405,10 +831,37 @@ def gen_criteria_sm(criteria,sm):
     </table>\n\n'''
     return html
 
-def _table2html(table,has_head=True):    
-    # add title
+@stage
+def _table2html(table,has_head=True,gap=None):    
+    # gap: (i, text), a row of text is inserted before the i-th row of a Table, e.g. for the omitted rows
     html = '''\t<table border="2px">\n''' # style="margin-left: 0; margin-right: auto;"
 
+    if isinstance(table, Table):
+        # the values are formatted here, and colored by the marks of format_table()
+        marks = getattr(table, "marks", {})
+        color = getattr(table, "color", None)
+        parts = [html]
+        if has_head:
+            parts.append('\t\t<thead><tr>' + ''.join('<th>%s</th>' % h for h in table.header) + '</tr></thead>\n')
+        parts.append('\t\t<tbody>')
+        columns = []
+        for j, name in enumerate(table.header):
+            values = table.column(j)
+            column = format_column(values, table.kind(j), column_format(name))
+            if j in marks:
+                column = ['<font color="%s">%s</font>' % (color[m == True], v) for v, m in zip(column, marks[j])]
+            columns.append(column)
+        for i, cells in enumerate(zip(*columns)):
+            if gap and gap[0] == i:
+                parts.append('\t\t\t<tr><td colspan="%d">%s</td></tr>\n' % (table.ncols, gap[1]))
+            parts.append('\t\t\t<tr><td>' + '</td><td>'.join(cells) + '</td></tr>\n')
+        if gap and gap[0] >= table.nrows:
+            # no rows after the gap, e.g. the tail of the omitted rows is not shown
+            parts.append('\t\t\t<tr><td colspan="%d">%s</td></tr>\n' % (table.ncols, gap[1]))
+        parts.append('\t\t</tbody>\n')
+        parts.append('\t</table>\n')
+        return ''.join(parts)
+
     # add table head
     start_row = 0
     if has_head:
@@ -443,12 +896,10 @@ def metrics2html(metrics_set):
     #    return ""
     
     table = dict2table(metric)
-    if not table:
+    if table is None or table.ncols == 0:
         print(f"Error: transfer {metric} to table failed!")
         return ""
-    if table in [[],None]:
-        return ""
-    if not sort: sort = [table[0][0]]
+    if not sort: sort = [table.header[0]]
     table, pass_num = format_table(table, metrics, sort, criteria)
     
     html = ""
@@ -505,13 +956,21 @@ def table2html(table_set):
         html += f'''\t<div class="tabletitle\">{title}</div>\n'''
         
     filetype = os.path.splitext(filename)[1]
-    if filetype == ".csv":
-        table = csv2table(filename)
-    else:
+    if filetype != ".csv":
         print(f"Error: file type '{filetype}' of table is not supported!")
         return ""
 
-    html += _table2html(table,has_head=True)
+    # a large table is shown by its first and last rows, with a link to the whole file
+    max_rows = table_set.get("max_rows", TABLE_MAX_ROWS)
+    tail = min(table_set.get("tail", TABLE_TAIL_ROWS), max_rows // 2) if max_rows else 0
+    header, head_rows, tail_rows, nrows = read_csv(filename, max_rows - tail if max_rows else None, tail)
+    table = _csv_rows2table(header, head_rows + tail_rows)
+    omitted = nrows - len(head_rows) - len(tail_rows)
+    if omitted > 0:
+        html += _table2html(table, has_head=True, gap=(len(head_rows), f"... {omitted} of {nrows} rows are not shown ..."))
+        html += f'\t<div class="doc"><a href="{filename}" download>Download the full csv ({nrows} rows)</a></div>\n'
+    else:
+        html += _table2html(table,has_head=True)
     if center:
         html = "\t<center>\n" + html + "\t</center>\n"
     return html
@@ -529,14 +988,343 @@ def image2html(image_set):
     for ifile in image_file:
         if not os.path.exists(ifile):
             print(f"Error: image '{ifile}' does not exist!")
-        html += f"""\t<img class="thumbnail" src="{ifile}" onclick="openFullscreen(this)">\n"""
+            thumbnail = None
+        else:
+            thumbnail = make_thumbnail(ifile)
+        if thumbnail:
+            html += f"""\t<img class="thumbnail" src="{thumbnail}" data-full="{ifile}" loading="lazy" onclick="openFullscreen(this)">\n"""
+        else:
+            html += f"""\t<img class="thumbnail" src="{ifile}" loading="lazy" onclick="openFullscreen(this)">\n"""
     
     if title != "":
         html += f'''\t<div class="imagetitle">{title}</div>\n'''
     if center:
         html = "\t<center>\n" + html + "\t</center>\n"
     return html
-    
+
+def make_thumbnail(image_file: str, size: tuple = None):
+    '''
+    Return the thumbnail of an image for the report, or None if the image should be shown as it is: no thumbnail
+    directory is set in the report context, Pillow is not installed, the image can not be read or it is small enough.
+    The thumbnails are written into the thumbnail directory, named by the hash of the content and the modification
+    time of the image, so that a thumbnail is made only once for an image and remade when the image is changed.
+    '''
+    context = current_context()
+    if not context.thumbnails:
+        return None
+    try:
+        from PIL import Image
+    except ImportError:
+        if not context.cache("warnings").get("thumbnail"):
+            context.cache("warnings")["thumbnail"] = True
+            print("Warning: Pillow is not installed, the images are shown without thumbnails.")
+        return None
+
+    size = size or THUMBNAIL_SIZE
+    cache = context.cache("thumbnails")
+    try:
+        stat = os.stat(image_file)
+        key = (os.path.abspath(image_file), stat.st_mtime_ns)
+        if key in cache:
+            return cache[key]
+        with open(image_file, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(image_file))[0]
+        thumbnail = os.path.join(context.thumbnails, f"{name}.{digest}.{stat.st_mtime_ns}.png")
+        if not os.path.isfile(thumbnail):
+            with Image.open(image_file) as image:
+                if image.width <= size[0] and image.height <= size[1]:
+                    thumbnail = None
+                else:
+                    image.thumbnail(size)
+                    os.makedirs(context.thumbnails, exist_ok=True)
+                    tmp_file = f"{thumbnail}.{os.getpid()}.tmp"
+                    image.save(tmp_file, format="PNG", optimize=True)
+                    os.replace(tmp_file, thumbnail)
+    except (OSError, ValueError) as e:
+        print(f"Warning: can not make the thumbnail of '{image_file}': {e}")
+        return None
+    cache[key] = thumbnail
+    return thumbnail
+
+def svg2html(svg_set):
+    '''
+    Embed inline svg plots, the content can be one svg string or a list of svg strings
+    '''
+    svg = svg_set.get("content","")
+    title = svg_set.get("title","")
+    center = svg_set.get("center",True)
+
+    if isinstance(svg,str):
+        svg = [svg]
+
+    html = ""
+    for isvg in svg:
+        if isvg:
+            html += f'''\t<div class="plot">{isvg}</div>\n'''
+    if html == "":
+        return ""
+
+    if title != "":
+        html += f'''\t<div class="imagetitle">{title}</div>\n'''
+    if center:
+        html = "\t<center>\n" + html + "\t</center>\n"
+    return html
+
+def _nice_ticks(lo, hi, num=5):
+    '''
+    Return about num round tick values between lo and hi
+    '''
+    raw = (hi - lo) / num
+    if not raw > 0:
+        return [lo]
+    mag = pow(10, math.floor(math.log10(raw)))
+    for m in (1, 2, 2.5, 5, 10):
+        step = m * mag
+        if step >= raw:
+            break
+    ticks = []
+    t = math.ceil(lo / step) * step
+    while t <= hi + step * 1e-6:
+        ticks.append(0.0 if abs(t) < step * 1e-6 else t)
+        t += step
+    return ticks
+
+def decimate_points(x, y, max_points=None, resolution=None):
+    '''
+    Thin out a scatter to at most max_points points.
+    Points falling into the same cell of a resolution x resolution grid (about one pixel of the plot) are drawn once,
+    and a regular stride is applied if there are still too many points.
+    '''
+    import numpy as np
+    if max_points is None: max_points = PLOT_MAX_POINTS
+    if resolution is None: resolution = PLOT_SIZE[0]
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    if x.size <= max_points:
+        return x, y
+
+    xspan = (x.max() - x.min()) or 1.0
+    yspan = (y.max() - y.min()) or 1.0
+    gx = np.rint((x - x.min()) / xspan * (resolution - 1)).astype(np.int64)
+    gy = np.rint((y - y.min()) / yspan * (resolution - 1)).astype(np.int64)
+    _, first = np.unique(gx * resolution + gy, return_index=True)
+    first.sort()
+    x, y = x[first], y[first]
+    if x.size > max_points:
+        idx = np.linspace(0, x.size - 1, max_points).astype(np.int64)
+        x, y = x[idx], y[idx]
+    return x, y
+
+def svg_plot(series, title="", xlabel="", ylabel="", mode="scatter", colors=None, diagonal=False, vline=None, xticks=None):
+    '''
+    Draw a compact svg plot and return it as a string
+    series: a list of (name, x, y), one entry for each data set
+    mode: "scatter", "line" or "bar". For "bar", x is the bin edges and y is the counts of each bin.
+    colors: a dict of {name: color}, default is to use PLOT_COLORS in order
+    diagonal: draw the y = x line and use the same range for both axes, used by parity plots
+    vline: draw a dashed vertical line at this x value, e.g. the threshold of a criteria
+    xticks: a list of (x, label) to replace the numeric ticks of x axis, at most 8 of them are labeled
+    '''
+    import numpy as np
+    width, height = PLOT_SIZE
+    left, right, top, bottom = 52, 10, 22, 36
+    pw, ph = width - left - right, height - top - bottom
+
+    data = []
+    for i, (name, x, y) in enumerate(series):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if mode == "scatter":
+            x, y = decimate_points(x, y)
+        elif mode == "line":
+            keep = np.isfinite(x) & np.isfinite(y)
+            order = np.argsort(x[keep], kind="stable")
+            x, y = x[keep][order], y[keep][order]
+        if x.size == 0:
+            continue
+        color = (colors or {}).get(name, PLOT_COLORS[i % len(PLOT_COLORS)])
+        data.append((name, x, y, color))
+    if not data:
+        return ""
+
+    xlo = min(d[1].min() for d in data)
+    xhi = max(d[1].max() for d in data)
+    ylo = min(d[2].min() for d in data)
+    yhi = max(d[2].max() for d in data)
+    if vline is not None:
+        xlo, xhi = min(xlo, vline), max(xhi, vline)
+    if diagonal:
+        xlo = ylo = min(xlo, ylo)
+        xhi = yhi = max(xhi, yhi)
+    if mode == "bar":
+        ylo = 0.0
+    xpad = (xhi - xlo) * 0.04 or abs(xhi) * 0.1 or 1.0
+    ypad = (yhi - ylo) * 0.04 or abs(yhi) * 0.1 or 1.0
+    if mode != "bar":
+        xlo, xhi = xlo - xpad, xhi + xpad
+    ylo, yhi = (ylo if mode == "bar" else ylo - ypad), yhi + ypad
+
+    sx = lambda v: left + (np.asarray(v, dtype=float) - xlo) / (xhi - xlo) * pw
+    sy = lambda v: top + ph - (np.asarray(v, dtype=float) - ylo) / (yhi - ylo) * ph
+
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" font-family="Verdana,sans-serif" font-size="9">'
+    svg += f'<rect x="{left}" y="{top}" width="{pw}" height="{ph}" fill="none" stroke="#444"/>'
+    if xticks:
+        xticks = xticks[::math.ceil(len(xticks) / 8)]
+    else:
+        xticks = [(t, f"{t:g}") for t in _nice_ticks(xlo, xhi)]
+    for t, label in xticks:
+        px = sx(t)
+        svg += f'<path d="M{px:.1f} {top + ph}v4" stroke="#444"/><text x="{px:.1f}" y="{top + ph + 13}" text-anchor="middle">{escape(str(label))}</text>'
+    for t in _nice_ticks(ylo, yhi):
+        py = sy(t)
+        svg += f'<path d="M{left} {py:.1f}h-4" stroke="#444"/><text x="{left - 6}" y="{py + 3:.1f}" text-anchor="end">{t:g}</text>'
+    if title:
+        svg += f'<text x="{left + pw / 2:.1f}" y="14" text-anchor="middle" font-size="11" font-weight="bold">{escape(title)}</text>'
+    if xlabel:
+        svg += f'<text x="{left + pw / 2:.1f}" y="{height - 4}" text-anchor="middle">{escape(xlabel)}</text>'
+    if ylabel:
+        svg += f'<text transform="translate(11 {top + ph / 2:.1f}) rotate(-90)" text-anchor="middle">{escape(ylabel)}</text>'
+    if diagonal:
+        svg += f'<path d="M{sx(xlo):.1f} {sy(ylo):.1f}L{sx(xhi):.1f} {sy(yhi):.1f}" stroke="#999" stroke-dasharray="4 3"/>'
+    if vline is not None:
+        svg += f'<path d="M{sx(vline):.1f} {top}v{ph}" stroke="#d62728" stroke-dasharray="4 3"/>'
+
+    for name, x, y, color in data:
+        px, py = sx(x), sy(y)
+        if mode == "scatter":
+            d = "".join("M%.1f %.1fh0" % p for p in zip(px, py))
+            svg += f'<path d="{d}" stroke="{color}" stroke-width="4" stroke-linecap="round" stroke-opacity="0.7" fill="none"/>'
+        elif mode == "line":
+            d = "M" + "L".join("%.1f %.1f" % p for p in zip(px, py))
+            dots = "".join("M%.1f %.1fh0" % p for p in zip(px, py))
+            svg += f'<path d="{d}" stroke="{color}" stroke-width="1.5" fill="none"/>'
+            svg += f'<path d="{dots}" stroke="{color}" stroke-width="4" stroke-linecap="round" fill="none"/>'
+        elif mode == "bar":
+            base = sy(0.0)
+            d = "".join("M%.1f %.1fH%.1fV%.1fH%.1fZ" % (px[j], base, px[j + 1], py[j], px[j]) for j in range(len(y)) if y[j] > 0)
+            svg += f'<path d="{d}" fill="{color}" fill-opacity="0.5" stroke="{color}"/>'
+
+    if len(data) > 1 or data[0][0]:
+        for i, (name, _, _, color) in enumerate(data):
+            ly = top + 10 + 11 * i
+            svg += f'<rect x="{left + 6}" y="{ly - 6}" width="7" height="7" fill="{color}"/><text x="{left + 16}" y="{ly}">{escape(str(name))}</text>'
+    svg += '</svg>'
+    return svg
+
+def png_bytes(rgb) -> bytes:
+    '''
+    Encode an image (height, width, 3) of uint8 as PNG, one pixel for each cell of a heatmap
+    '''
+    import numpy as np
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    h, w, _ = rgb.shape
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgb.reshape(h, w * 3)], axis=1).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)) \
+        + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+def heat_colors(ratio):
+    '''
+    Map value / threshold to colors: green at 0, yellow at 1 (the threshold) and red at 2 or above, grey for NaN
+    '''
+    import numpy as np
+    ratio = np.asarray(ratio, dtype=float)
+    t = np.clip(np.nan_to_num(np.abs(ratio), nan=0.0) / 2, 0, 1)[..., None]
+    stops = np.array(HEAT_COLORS, dtype=float)
+    low = stops[0] + (stops[1] - stops[0]) * (t * 2)
+    high = stops[1] + (stops[2] - stops[1]) * (t * 2 - 1)
+    rgb = np.where(t < 0.5, low, high)
+    rgb[np.isnan(ratio)] = HEAT_NAN_COLOR
+    return rgb.round().astype(np.uint8)
+
+def order_rows(ratio, sort: str = "difficulty"):
+    '''
+    The order of the rows of a matrix of value / threshold (rows: confs, columns: models)
+    sort: "difficulty" puts the rows with the largest mean ratio over the models first,
+          "cluster" orders the rows by their projection on the first principal axis, so that the similar rows are close,
+          otherwise the rows are kept
+    '''
+    import numpy as np
+    n = ratio.shape[0]
+    if n == 0 or sort not in ["difficulty", "cluster"]:
+        return np.arange(n)
+    a = np.abs(ratio)
+    with np.errstate(invalid="ignore"):
+        valid = ~np.isnan(a).all(axis=1)
+        score = np.where(valid, np.nanmean(np.where(valid[:, None], a, 0.0), axis=1), -np.inf)
+    if sort == "cluster" and ratio.shape[1] > 1:
+        z = np.clip(a, 0, 4)
+        col_mean = np.nanmean(np.where(np.isnan(z).all(axis=0), 0.0, z), axis=0)
+        z = np.where(np.isnan(z), col_mean, z)
+        z = z - z.mean(axis=0)
+        _, _, vt = np.linalg.svd(z, full_matrices=False)
+        proj = z @ vt[0]
+        # the direction of the axis is arbitrary, let the difficult rows go first
+        if valid.sum() > 1 and np.dot(proj[valid] - proj[valid].mean(), score[valid] - score[valid].mean()) < 0:
+            proj = -proj
+        score = np.where(valid, proj, -np.inf)
+    return np.argsort(-score, kind="stable")
+
+def svg_heatmap(ratio, row_labels: list, col_labels: list, title: str = "", threshold: float = 1.0) -> str:
+    '''
+    A heatmap of a matrix of value / threshold (rows: confs, columns: models) as one svg with the matrix in one PNG image.
+    If there are more than HEATMAP_MAX_ROWS rows, each row of the image is the worst (largest) of a block of rows.
+    The row labels are shown only for at most HEATMAP_LABEL_ROWS rows.
+    '''
+    import numpy as np
+    ratio = np.asarray(ratio, dtype=float).reshape(len(row_labels), len(col_labels))
+    nrows, ncols = ratio.shape
+    block = max(1, math.ceil(nrows / HEATMAP_MAX_ROWS))
+    if block > 1:
+        # the largest |ratio| of each block, NaN only if all of the block are NaN
+        a = np.abs(ratio)
+        image = np.fmax.reduceat(np.where(np.isnan(a), -np.inf, a), np.arange(0, nrows, block), axis=0)
+        image[np.isneginf(image)] = np.nan
+    else:
+        image = ratio
+
+    labeled = nrows <= HEATMAP_LABEL_ROWS
+    cell_w = 24
+    row_h = 12 if labeled else max(1, min(4, HEATMAP_MAX_ROWS // max(1, image.shape[0])))
+    left = 8 + (min(max(len(str(r)) for r in row_labels), 40) * 6 if labeled and nrows else 40)
+    top = 30 + min(max([len(str(c)) for c in col_labels] + [1]), 24) * 5
+    pw, ph = cell_w * ncols, row_h * image.shape[0]
+    width, height = max(left + pw + 80, 220), top + ph + 20
+
+    png = base64.b64encode(png_bytes(heat_colors(image))).decode()
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" font-family="Verdana,sans-serif" font-size="9">'
+    if title:
+        svg += f'<text x="{left}" y="14" font-size="11" font-weight="bold">{escape(title)}</text>'
+    svg += f'<image x="{left}" y="{top}" width="{pw}" height="{ph}" preserveAspectRatio="none" style="image-rendering:pixelated" href="data:image/png;base64,{png}"/>'
+    svg += f'<rect x="{left}" y="{top}" width="{pw}" height="{ph}" fill="none" stroke="#444"/>'
+    for j, label in enumerate(col_labels):
+        x = left + cell_w * j + cell_w / 2
+        svg += f'<text transform="translate({x + 3:.1f} {top - 4}) rotate(-60)">{escape(str(label)[-24:])}</text>'
+    if labeled:
+        for i, label in enumerate(row_labels):
+            svg += f'<text x="{left - 4}" y="{top + row_h * i + 9}" text-anchor="end">{escape(str(label)[-40:])}</text>'
+    else:
+        svg += f'<text x="{left - 4}" y="{top + 8}" text-anchor="end">1</text><text x="{left - 4}" y="{top + ph}" text-anchor="end">{nrows}</text>'
+        if block > 1:
+            svg += f'<text x="{left}" y="{top + ph + 14}">each row: the worst of {block} confs</text>'
+
+    # the color scale, in the unit of the metric
+    lx, ly = left + pw + 14, top
+    stops = "".join(f'<stop offset="{o}" stop-color="rgb{tuple(c)}"/>' for o, c in zip(["0", "0.5", "1"], HEAT_COLORS))
+    svg += f'<defs><linearGradient id="heat" x1="0" y1="1" x2="0" y2="0">{stops}</linearGradient></defs>'
+    svg += f'<rect x="{lx}" y="{ly}" width="10" height="80" fill="url(#heat)" stroke="#444"/>'
+    for frac, label in [(0, "0"), (0.5, f"{threshold:g}"), (1, f">={2 * threshold:g}")]:
+        svg += f'<text x="{lx + 14}" y="{ly + 80 - 80 * frac + 3:.1f}">{label}</text>'
+    svg += f'<rect x="{lx}" y="{ly + 90}" width="10" height="10" fill="rgb{tuple(HEAT_NAN_COLOR)}" stroke="#444"/><text x="{lx + 14}" y="{ly + 98}">none</text>'
+    svg += '</svg>'
+    return svg
+
 def text2html(text_set):
     '''
     Transform a text to html format
@@ -561,8 +1349,12 @@ def get_job_address():
     return job
 
 def get_version():
-    if os.path.isfile("version.dat"):
-        with open("version.dat") as f:
+    context = current_context()
+    if context.version is not None:
+        return context.version
+    version_file = os.path.join(context.workdir, "version.dat")
+    if os.path.isfile(version_file):
+        with open(version_file) as f:
             version = f.read().strip()
     else:
         version = ""
@@ -616,7 +1408,8 @@ def gen_script(has_image=False):
         var fullscreenImage = document.getElementById("fullscreenImage");
         
         function openFullscreen(imgElement) {
-            fullscreenImage.src = imgElement.src; 
+            // the full image of a thumbnail is only loaded here
+            fullscreenImage.src = imgElement.getAttribute("data-full") || imgElement.src; 
             overlay.style.display = "block";
         }
         
@@ -632,7 +1425,127 @@ def gen_script(has_image=False):
     
     return html
 
-def gen_html(report_setting, output):
+def _read_asset(path):
+    '''
+    Read a local file and return the content hash and the data uri of it, return None if it can not be read.
+    The assets are cached in the report context by the path, modification time and size.
+    '''
+    try:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        cache = current_context().cache("assets")
+        if key in cache:
+            return cache[key]
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        print(f"Error: asset '{path}' can not be read, keep it as a link!")
+        return None
+    mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    cache[key] = (digest, f"data:{mime};base64," + base64.b64encode(data).decode())
+    return cache[key]
+
+def bundle_html(html, attrs=("src",)):
+    '''
+    Inline the local images of a report, so that the report is one self-contained file.
+    The images are deduplicated by content hash: an image used once is inlined as a data uri,
+    an image used more than once is stored once in an asset table and set by a script when the page is loaded.
+    The css in the head is also compacted.
+    '''
+    attr_pattern = re.compile(r'\b(%s)="([^"]*)"' % "|".join(attrs))
+    img_pattern = re.compile(r'<img\b[^>]*>')
+    local = lambda ref: ref and not re.match(r"^(data:|[a-z]+://|#)", ref)
+
+    # first pass: read each local file once and count the usage of each content
+    assets = {}
+    usage = {}
+    for tag in img_pattern.findall(html):
+        for _, ref in attr_pattern.findall(tag):
+            if local(ref) and ref not in assets:
+                assets[ref] = _read_asset(ref)
+            if assets.get(ref):
+                usage[assets[ref][0]] = usage.get(assets[ref][0], 0) + 1
+
+    # second pass: replace the links
+    table = {}
+    def replace_attr(m):
+        asset = assets.get(m.group(2))
+        if not asset:
+            return m.group(0)
+        digest, uri = asset
+        if usage[digest] == 1:
+            return f'{m.group(1)}="{uri}"'
+        table[digest] = uri
+        return f'data-asset-{m.group(1)}="{digest}"'
+    html = img_pattern.sub(lambda m: attr_pattern.sub(replace_attr, m.group(0)), html)
+
+    if table:
+        script = '''\t<script>\n\tvar ASSETS = %s;\n''' % json.dumps(table)
+        for attr in attrs:
+            script += '''\tdocument.querySelectorAll("img[data-asset-%s]").forEach(function(e) {e.setAttribute("%s", ASSETS[e.getAttribute("data-asset-%s")]);});\n''' % (attr, attr, attr)
+        script += '''\t</script>\n'''
+        html = html.replace("</body>", script + "</body>", 1)
+
+    html = re.sub(r"<style>(.*?)</style>", lambda m: "<style>" + re.sub(r"\s+", " ", m.group(1)).strip() + "</style>", html, count=1, flags=re.S)
+    return html
+
+@stage
+def write_html(html, output, compress=None):
+    '''
+    Write the report, and also a precompressed copy of it if compress is "gzip" (output.gz) or "brotli" (output.br).
+    output is a file name, or a writable text stream, to which the copy is not written.
+    '''
+    if hasattr(output, "write"):
+        output.write(html)
+        if compress:
+            print(f"Warning: the report is written to a stream, no {compress} copy is written.")
+        return
+
+    with open(output,"w") as f:
+        f.write(html)
+
+    if compress == "brotli":
+        try:
+            import brotli
+        except ImportError:
+            print("Warning: brotli is not installed, use gzip instead.")
+            compress = "gzip"
+        else:
+            with open(output + ".br", "wb") as f:
+                f.write(brotli.compress(html.encode()))
+    if compress == "gzip":
+        with open(output + ".gz", "wb") as f:
+            f.write(gzip.compress(html.encode(), compresslevel=9, mtime=0))
+
+def item2html(item):
+    '''
+    Transform one content item of the report to html
+    '''
+    itype = item.get("type","text")
+    icontent = item.get("content","")
+    if itype in ["head1","head2","head3"]:
+        return f'''\t<div class="{itype}">{icontent}</div>\n'''
+    elif itype == "text":
+        return text2html(item)
+    elif itype == "image":
+        return image2html(item)
+    elif itype == "svg":
+        return svg2html(item)
+    elif itype == "table":
+        return table2html(item)
+    elif itype == "metrics":
+        return metrics2html(item)
+    elif itype == "supermetrics":
+        return supermetrics2html(item)
+    elif itype == "query":
+        return query2html(item)
+    elif itype == "html":
+        return icontent
+    else:
+        return ""
+
+def gen_html(report_setting, output, bundle=False, compress=None):
     '''
     A report should be like this:
     Test Date/Version/Targets/Datasets/Properties/Criteria/Job Address:
@@ -658,9 +1571,12 @@ def gen_html(report_setting, output):
     head3:
     text:
     image:
+    svg:
     table:
     metrics:
     supermetrics:
+    query:
+    html:
     
     If the content is a table, it can have an extra criteria to color the value, and if the value pass the criteria, the value will be colored to green, else red.
     If the content is a table or image, it can have an extra title.
@@ -680,6 +1596,11 @@ def gen_html(report_setting, output):
         "content": "image1.png",
         "title": "This is a image"
     },
+    {
+        "type": "svg",
+        "content": "<svg ...>...</svg>" or ["<svg ...>...</svg>", ...],  # inline svg plots, see svg_plot()
+        "title": "This is a plot"
+    },
     {
         "type": "table",
         "title": "This is a table",
@@ -704,102 +1625,285 @@ def gen_html(report_setting, output):
             "key1": "x > 0",
             "key2": "x < 1", # key is the name of the column, and the criteria is a string, should be evaluated by python
         }
+    },
+    {
+        "type": "query",  # the result of a sql query on the results database, see query2html()
+        "title": "This is a query",
+        "content": "SELECT ...",
+        "db": "results.db"
+    },
+    {
+        "type": "html",  # html rendered before, e.g. by item2html(), is written as it is
+        "content": "<div>...</div>"
     }
     '''
     
+    html = render_html(report_setting, bundle)
+    write_html(html, output, compress)
+    
+    return html
+
+@stage
+def render_html(report_setting, bundle=False):
+    '''
+    Render the report to a html string, see gen_html() for the format of report_setting
+    bundle: inline the images shown in the report (see bundle_html()), "full" also inlines the full-size images
+    of the thumbnails, which are otherwise loaded only when they are opened
+    '''
     keys = report_setting.get("keys",{})
     
-    html = HTML_HEAD + "\n<body>\n"
-    html += keys2html(keys) + "\n"
+    parts = [HTML_HEAD + "\n<body>\n", keys2html(keys) + "\n"]
 
-    # write content
+    # write content, the parts are joined once at the end
     has_image = False
     for content in report_setting.values():
         for item in content:
-            itype = item.get("type","text")
-            icontent = item.get("content","")
-            if itype in ["head1","head2","head3"]:
-                html += f'''\t<div class="{itype}">{icontent}</div>\n'''
-            elif itype == "text":
-                html += text2html(item)
-            elif itype == "image":
-                html += image2html(item)
+            parts.append(item2html(item))
+            if item.get("type","text") == "image":
                 has_image = True
-            elif itype == "table":
-                html += table2html(item)
-            elif itype == "metrics":
-                html += metrics2html(item)
-            elif itype == "supermetrics":
-                html += supermetrics2html(item)
-            else:
-                continue
-    html += "\n"
+    parts.append("\n")
     
     # add script for image zoom
-    html += gen_script(has_image)
+    parts.append(gen_script(has_image))
          
-    html += """\n</body>\n</html>"""
-    
-    with open(output,"w") as f:
-        f.write(html)
-    
+    parts.append("""\n</body>\n</html>""")
+    html = "".join(parts)
+
+    if bundle:
+        html = bundle_html(html, ("src", "data-full") if bundle == "full" else ("src",))
     return html
 
 def ReportArgs(parser):  
-    parser.description = "Read metrics.json and generate the report"
+    parser.description = "Read the report settings (see gen_html()) from a json file and generate the report"
     parser.add_argument('-p', '--param', type=str, help='the parameter file, should be .json type', required=True)
-    parser.add_argument('-o', '--output', type=str,  default="abacustest.html", help='The output file name, default is abacustest.html')
+    parser.add_argument('-o', '--output', type=str,  default=None, help='The output file name, default is the output in the parameter file or results.html')
     return parser
 
-def Report(all_dict: dict):
-    _init()
-    report_setting = all_dict.get("report", {})
-    if report_setting == {}:
-        print("Error: report section is empty!")
-        sys.exit(1)
+def ArchiveArgs(parser):
+    # the options to load the archives, shared by the report and ingest subcommands
+    parser.add_argument('paths', type=str, nargs='*', help='the all_result.json files, glob patterns are supported, compressed files (.gz, .xz, .bz2) are read transparently')
+    parser.add_argument('--decoder', type=str, default="auto", choices=["auto", "orjson", "ujson", "json", "monty"], help='the JSON decoder, auto (default) takes the fastest installed one, monty also reconstructs the MSONable objects')
+    parser.add_argument('--cache', type=str, default=None, metavar='DIR', help='cache the decoded archives and the summaries of rounds in DIR, unchanged archives are not decoded again')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='decode the archives by JOBS processes, default is 1')
+    parser.add_argument('--model', type=str, action='append', metavar='PATTERN', help='only report the models whose tag, work path or file path matches the glob PATTERN, can be repeated; the reference datasets (Expt, DFT(abacus)) are always kept')
+    parser.add_argument('--exclude-model', type=str, action='append', metavar='PATTERN', help='leave out the models whose tag, work path or file path matches the glob PATTERN, can be repeated; the archives excluded by the file path are not decoded, only their heads are read to find the reference datasets')
+    parser.add_argument('--conf', type=str, default=None, metavar='REGEX', help='only report the confs matching REGEX')
+    parser.add_argument('--exclude-conf', type=str, default=None, metavar='REGEX', help='leave out the confs matching REGEX')
+    parser.add_argument('--point-group', type=str, action='append', metavar='PG', help='only report the confs of the point group PG (e.g. m-3m), can be repeated')
+    parser.add_argument('--property', type=str, action='append', choices=["elastic", "eos"], help='only report the property, can be repeated')
+    parser.add_argument('--dedup', action='store_true', help='skip the archives with the same contents as an earlier one, and the conf results which are the same as those of an earlier archive with the same tag (or work path if untagged)')
+    parser.add_argument('--stream', action='store_true', help='load the reference datasets first and then the models one by one, so that at most one model archive is in memory')
+    parser.add_argument('--derived', action='store_true', help='also give the Reuss and Hill moduli, Young\'s modulus, Poisson ratio and anisotropy index derived from the elastic tensors, and their relative errors against Expt and DFT(abacus)')
+    parser.add_argument('--exclude-invalid', action='store_true', help='do not score the invalid elastic tensors (NaN/inf, asymmetric or mechanically unstable), by default they are only flagged in the valid column')
+    return parser
 
-    output = "results.html"
-    gen_html(report_setting, output)
+def ApexReportArgs(parser):
+    parser.description = "Collect the all_result.json archives of APEX and generate the report results.html"
+    ArchiveArgs(parser)
+    parser.add_argument('-o', '--output', type=str, default=None, help='the output file name, default is results.html, or shard-I-of-N.json.gz with --shard')
+    parser.add_argument('--shard', type=str, default=None, metavar='I/N', help='only compute the I-th of N shards of the confs and write the tables and summaries into a shard file instead, the shards are merged into the report by the merge subcommand')
+    parser.add_argument('--bundle', action='store_true', help='inline the local images into the report, repeated images are stored only once')
+    parser.add_argument('--bundle-full', action='store_true', help='with --bundle, also inline the full-size images of the thumbnails, by default they are linked and loaded only when opened')
+    parser.add_argument('--thumbnails', type=str, default=None, metavar='DIR', help='show the images by thumbnails written into DIR (needs Pillow), the full-size image is loaded when a thumbnail is opened')
+    parser.add_argument('--compress', type=str, choices=["gzip", "brotli"], default=None, help='also write a precompressed copy of the report, OUTPUT.gz or OUTPUT.br')
+    parser.add_argument('--axis', type=str, choices=["conf", "model", "both"], default="conf", help='the tables of the results are given for each conf (default), for each model with all confs as rows, or both')
+    parser.add_argument('--overview', type=str, default=None, choices=["difficulty", "cluster", "conf"], help='add conf x model heatmaps of CV_DFT, CV_Expt and MAE_DFT to the summary, with the confs sorted by difficulty, clustered, or by names')
+    parser.add_argument('--group-by', type=str, action='append', metavar='KEY', help='add the summaries for each group of confs, KEY is point_group, element, or a json/csv file mapping the confs to groups, can be repeated')
+    parser.add_argument('--top', type=int, default=None, metavar='N', help='list the N worst confs of each model in the summary, default is 10, 0 to disable')
+    parser.add_argument('--db', type=str, default=None, metavar='FILE', help='also write the metrics into the sqlite database FILE, which can be queried by "report_apex_html.py query FILE ..."')
+    parser.add_argument('--trend', type=str, action='append', metavar='LABEL=GLOB', help='build a trend report over several rounds of results instead, one round for each LABEL=GLOB in the order of time')
+    parser.add_argument('--watch', action='store_true', help='keep running and regenerate the report when the archives matching the paths are created or changed')
+    parser.add_argument('--debounce', type=float, default=2.0, metavar='SECONDS', help='in watch mode, wait until the files are unchanged for this time before updating, default is 2')
+    parser.add_argument('--serve', type=str, default=None, metavar='[HOST:]PORT', help='serve the report by a local http server instead of writing OUTPUT, the table of a conf is rendered when it is opened')
+    PrecisionArgs(parser)
+    parser.add_argument('--profile', type=str, default=None, metavar='DIR', help='profile each stage (loading, metrics, formatting, rendering, writing) by cProfile and tracemalloc, and write the stats, the collapsed stacks for flamegraphs and the top allocations into DIR')
+    parser.add_argument('--report-version', type=str, default=None, metavar='TEXT', help='the version shown in the report, default is read from version.dat in the current directory')
+    parser.add_argument('--poll', type=float, default=10.0, metavar='SECONDS', help='in watch mode, rescan the files at least this often, e.g. for network file systems without notifications, default is 10')
+    return parser
 
-def simplify_paths(path_list: list) -> dict:
-    # only one path, return it with only basename
-    if len(path_list) == 1:
-        return {path_list[0]: '.../' + os.path.basename(path_list[0])}
-    else:
-        # Split all paths into components
-        split_paths = [os.path.normpath(p).split(os.sep) for p in path_list]
+def PrecisionArgs(parser):
+    parser.add_argument('--precision', type=str, action='append', metavar='COLUMN=SPEC', help='the format of the numbers in the columns matching the glob COLUMN, SPEC is the number of decimals or Ng for N significant figures, e.g. "c??=1" or "CV_*=3g", can be repeated, default is 4 decimals')
+    return parser
 
-        # Find common prefix
-        common_prefix = os.path.commonprefix(split_paths)
-        common_prefix_len = len(common_prefix)
+def parse_precision(precision_args: list) -> dict:
+    '''
+    Parse the COLUMN=SPEC arguments of --precision into {COLUMN: SPEC}, SPEC is an int or "Ng"
+    '''
+    precision = {}
+    for arg in precision_args or []:
+        pattern, sep, spec = arg.partition("=")
+        if not sep or not pattern or not re.fullmatch(r"\d+g?", spec.strip()):
+            raise ValueError(f"Invalid precision '{arg}', should be COLUMN=N or COLUMN=Ng")
+        spec = spec.strip()
+        precision[pattern] = spec if spec.endswith("g") else int(spec)
+    return precision
 
-        # Remove common prefix from each path and create dictionary
-        simplified_paths_dict = {
-            os.sep.join(p): '.../' + os.sep.join(p[common_prefix_len:]) if common_prefix_len else os.sep.join(p)
-            for p in split_paths
-        }
+def IngestArgs(parser):
+    parser.description = "Collect the all_result.json archives of APEX and write the metrics into a sqlite database"
+    ArchiveArgs(parser)
+    parser.add_argument('--db', type=str, required=True, metavar='FILE', help='the sqlite database, the rows of the ingested models are replaced by their names, the rows of the other names are kept')
+    return parser
 
-        return simplified_paths_dict
+def MergeArgs(parser):
+    parser.description = "Merge the shard files written by report --shard I/N and generate the report"
+    parser.add_argument('shards', type=str, nargs='+', help='the shard files, glob patterns are supported')
+    parser.add_argument('-o', '--output', type=str, default="results.html", help='the output file name, default is results.html')
+    parser.add_argument('--bundle', action='store_true', help='inline the local images into the report, repeated images are stored only once')
+    parser.add_argument('--bundle-full', action='store_true', help='with --bundle, also inline the full-size images of the thumbnails, by default they are linked and loaded only when opened')
+    parser.add_argument('--thumbnails', type=str, default=None, metavar='DIR', help='show the images by thumbnails written into DIR (needs Pillow), the full-size image is loaded when a thumbnail is opened')
+    parser.add_argument('--compress', type=str, choices=["gzip", "brotli"], default=None, help='also write a precompressed copy of the report, OUTPUT.gz or OUTPUT.br')
+    parser.add_argument('--axis', type=str, choices=["conf", "model", "both"], default="conf", help='the tables of the results are given for each conf (default), for each model with all confs as rows, or both')
+    parser.add_argument('--overview', type=str, default=None, choices=["difficulty", "cluster", "conf"], help='add conf x model heatmaps of CV_DFT, CV_Expt and MAE_DFT to the summary, with the confs sorted by difficulty, clustered, or by names')
+    PrecisionArgs(parser)
+    return parser
 
-def tag_dataset(orig_dataset: dict) -> dict:
-    orig_work_path_list = [k for k in orig_dataset.keys()]
-    try:
-        simplified_path_dict = simplify_paths(orig_work_path_list)
-        simplified_dataset = {simplified_path_dict[k]: v for k, v in orig_dataset.items()}
-    except KeyError:
-        simplified_dataset = orig_dataset
-    
-    # replace data id with tag specified in the dataset if exists
-    tagged_dataset = {}
-    for k, v in simplified_dataset.items():
-        if tag := v.pop('tag', None):
-            tagged_dataset[tag] = v
-        else:
-            tagged_dataset[k] = v
-    
-    return tagged_dataset
+def RescoreArgs(parser):
+    parser.description = "Judge the metrics in the database again by new criteria, without reading the archives"
+    parser.add_argument('db', type=str, help='the sqlite database written by ingest or report --db')
+    parser.add_argument('--criteria', type=str, action='append', metavar='METRIC=EXPR', help='the criteria of METRIC, e.g. "CV_DFT=abs(x) < 0.1", can be repeated; the other metrics are judged by the default criteria')
+    return parser
 
-def cal_relative_error(predicted, actual):
+def ExportArgs(parser):
+    parser.description = "Export the metrics in the database as csv or json"
+    parser.add_argument('db', type=str, help='the sqlite database written by ingest or report --db')
+    parser.add_argument('-o', '--output', type=str, default="-", help='the output file, default is the standard output')
+    parser.add_argument('--format', type=str, choices=["csv", "json"], default=None, help='the output format, default is taken from the suffix of OUTPUT, or csv')
+    parser.add_argument('--sql', type=str, default="SELECT * FROM metrics ORDER BY model, conf, prop, metric", help='the sql query to export, default is all metrics')
+    return parser
+
+def CliArgs(parser):
+    parser.description = "Report the all_result.json archives of APEX, the report subcommand is taken if no subcommand is given"
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    for name, args_func, main_func, help in [
+        ("report", ApexReportArgs, report_main, "generate the html report (default)"),
+        ("merge", MergeArgs, merge_main, "merge the shards of report --shard into the report"),
+        ("ingest", IngestArgs, ingest_main, "write the metrics into a sqlite database"),
+        ("rescore", RescoreArgs, rescore_main, "judge the metrics in the database by new criteria"),
+        ("query", QueryArgs, query_main, "query the database"),
+        ("export", ExportArgs, export_main, "export the database as csv or json"),
+        ("bench", BenchArgs, bench_main, "compare the JSON decoders"),
+        ("render", ReportArgs, render_main, "generate the report from the report settings in a json file"),
+    ]:
+        args_func(subparsers.add_parser(name, help=help)).set_defaults(func=main_func)
+    return parser
+
+def selection_from_args(args) -> "Selection":
+    shard = parse_shard(args.shard) if getattr(args, "shard", None) else None
+    return Selection(args.model, args.exclude_model, args.conf, args.exclude_conf, args.point_group, args.property, shard)
+
+def Report(all_dict: dict, context: ReportContext = None):
+    report_setting = all_dict.get("report", {})
+    if report_setting == {}:
+        print("Error: report section is empty!")
+        sys.exit(1)
+
+    output = all_dict.get("output", "results.html")
+    if context is None:
+        context = ReportContext(version=all_dict.get("version", None), job_address=all_dict.get("job_address", ""), thumbnails=all_dict.get("thumbnails", None),
+                                precision=all_dict.get("precision", None))
+    build_report(report_setting, output, bundle=all_dict.get("bundle", False), compress=all_dict.get("compress", None), context=context)
+
+def build_report(report_setting: dict, output=None, bundle: bool = False, compress: str = None, context: ReportContext = None) -> str:
+    '''
+    Render the report (see gen_html() for the format of report_setting) and return the html.
+    The html is also written to output if given, a file name or a writable text stream.
+    The report is built in a copy of the current contextvars context with context (a new ReportContext by default)
+    as the current report context, so that several reports can be built at the same time, e.g. by a thread pool;
+    the time spent in each stage is kept in context.timings.
+    '''
+    return contextvars.copy_context().run(_build_report, report_setting, output, bundle, compress, context or ReportContext())
+
+def _build_report(report_setting, output, bundle, compress, context):
+    _init(context)
+    html = render_html(report_setting, bundle)
+    if output is not None:
+        write_html(html, output, compress)
+    return html
+
+class PathIndex:
+    '''
+    A trie of the work paths, built from the last path component to the first one.
+    The label of a work path is its shortest suffix which is not shared by other work paths, e.g.
+    /data/apex/dp/run and /data/apex/mace/run are labeled as .../dp/run and .../mace/run.
+    The name (tag or label) of each model is registered, so that a model can be looked up by its name later.
+    '''
+    def __init__(self, path_list=()):
+        self.root = {}   # {component: [number of paths through this node, {child component: ...}]}
+        self.names = {}  # {name: work path}
+        for path in path_list:
+            self.add(path)
+
+    def add(self, path):
+        children = self.root
+        for comp in reversed(os.path.normpath(path).split(os.sep)):
+            node = children.setdefault(comp, [0, {}])
+            node[0] += 1
+            children = node[1]
+
+    def label(self, path):
+        '''
+        Return the shortest unique suffix of a path added before, or the whole path if it is not unique
+        '''
+        comps = os.path.normpath(path).split(os.sep)
+        children = self.root
+        for depth, comp in enumerate(reversed(comps), 1):
+            node = children[comp]
+            if node[0] == 1:
+                break
+            children = node[1]
+        if depth == len(comps):
+            return os.sep.join(comps)
+        return '.../' + os.sep.join(comps[-depth:])
+
+    def register(self, name, path):
+        '''
+        Register the name of a work path and return it. If the name is used by another work path,
+        the label of the path (or a number) is appended to make it unique.
+        '''
+        if self.names.get(name, path) != path:
+            new_name = name
+            label = self.label(path)
+            if label != name:
+                new_name = f"{name} ({label})"
+            n = 2
+            while self.names.get(new_name, path) != path:
+                new_name = f"{name}#{n}"
+                n += 1
+            print(f"Warning: name '{name}' of {path} is used by {self.names[name]}, rename it to '{new_name}'")
+            name = new_name
+        self.names[name] = path
+        return name
+
+    def lookup(self, name):
+        # return the work path of a model by its name, None if not found
+        return self.names.get(name)
+
+def simplify_paths(path_list: list) -> dict:
+    index = PathIndex(path_list)
+    return {p: index.label(p) for p in path_list}
+
+def tag_dataset(orig_dataset: dict, index: PathIndex = None) -> dict:
+    '''
+    Name each dataset by its tag if exists, otherwise by the simplified work path.
+    The names are made unique, so that no dataset is overwritten. The names are registered in index if given.
+    '''
+    if index is None:
+        index = PathIndex()
+    for k in orig_dataset.keys():
+        index.add(k)
+
+    # replace data id with tag specified in the dataset if exists
+    tagged_dataset = {}
+    for k, v in orig_dataset.items():
+        # do not modify the loaded archive, it may be shared by several datasets
+        if tag := v.get('tag', None):
+            tagged_dataset[index.register(tag, k)] = {ik: iv for ik, iv in v.items() if ik != 'tag'}
+        else:
+            tagged_dataset[index.register(index.label(k), k)] = v
+    
+    return tagged_dataset
+
+def cal_relative_error(predicted, actual):
     """
     predicted (float): predicted value
     actual (float): actual value
@@ -812,6 +1916,7 @@ def cal_cij_CV(predicted: list, actual: list, point_group_sym: str):
     """
     categories based on point group symbols in DFT
     """
+    import numpy as np
     if str(point_group_sym) in ['m-3m']:
         ela_pred_tensor = np.array([predicted[0][0], predicted[0][1], predicted[3][3]])
         ela_actu_tensor = np.array([actual[0][0], actual[0][1], actual[3][3]])
@@ -826,11 +1931,118 @@ def cal_cij_CV(predicted: list, actual: list, point_group_sym: str):
     
     return CV_value
 
-def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
+def validate_elastic_tensors(tensors, tol: float = None) -> list:
+    '''
+    Check a stack of elastic tensors (N, 6, 6) at once, return the problems of each tensor, "" if it is valid, or some of
+    "nan" (NaN or inf in the tensor), "asymmetric" (|Cij - Cji| > tol * max|Cij|) and "unstable" (not positive definite,
+    i.e. the Born stability criteria are not met), separated by ",".
+    '''
+    import numpy as np
+    if tol is None: tol = TENSOR_SYMMETRY_TOL
+    c = np.asarray(tensors, dtype=float).reshape(-1, 6, 6)
+    if len(c) == 0:
+        return []
+
+    finite = np.isfinite(c).all(axis=(1, 2))
+    c = np.where(finite[:, None, None], c, np.eye(6))
+    ct = c.transpose(0, 2, 1)
+    symmetric = np.abs(c - ct).max(axis=(1, 2)) <= tol * np.abs(c).max(axis=(1, 2))
+    stable = np.linalg.eigvalsh(0.5 * (c + ct))[:, 0] > 0
+
+    problems = []
+    for ok_finite, ok_symmetric, ok_stable in zip(finite.tolist(), symmetric.tolist(), stable.tolist()):
+        if not ok_finite:
+            problems.append("nan")
+        else:
+            problems.append(",".join(p for p, ok in [("asymmetric", ok_symmetric), ("unstable", ok_stable)] if not ok))
+    return problems
+
+def derive_elastic_properties(tensors) -> dict:
+    '''
+    The derived properties of a stack of elastic tensors (N, 6, 6) in Voigt notation, computed at once from the batched
+    compliance tensors S = inv(C): the Voigt, Reuss and Hill bulk/shear moduli BV, GV, BR, GR, BH, GH, the Young's modulus E
+    and the Poisson ratio nu from the Hill moduli, and the universal anisotropy index AU = 5 GV/GR + BV/BR - 6.
+    Return {property: array of N values}, the values of the non-finite or singular tensors are NaN.
+    '''
+    import numpy as np
+    c = np.asarray(tensors, dtype=float).reshape(-1, 6, 6)
+    ok = np.isfinite(c).all(axis=(1, 2))
+    ok[ok] = np.linalg.det(c[ok]) != 0
+    c = np.where(ok[:, None, None], c, np.eye(6))
+    sc = np.linalg.inv(c)
+
+    def trace3(m):
+        return m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    def off3(m):
+        return m[:, 0, 1] + m[:, 1, 2] + m[:, 2, 0]
+    def shear3(m):
+        return m[:, 3, 3] + m[:, 4, 4] + m[:, 5, 5]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        BV = (trace3(c) + 2 * off3(c)) / 9
+        GV = (trace3(c) - off3(c) + 3 * shear3(c)) / 15
+        BR = 1 / (trace3(sc) + 2 * off3(sc))
+        GR = 15 / (4 * trace3(sc) - 4 * off3(sc) + 3 * shear3(sc))
+        BH = (BV + BR) / 2
+        GH = (GV + GR) / 2
+        E = 9 * BH * GH / (3 * BH + GH)
+        nu = (3 * BH - 2 * GH) / (2 * (3 * BH + GH))
+        AU = 5 * GV / GR + BV / BR - 6
+    derived = {"BV": BV, "GV": GV, "BR": BR, "GR": GR, "BH": BH, "GH": GH, "E": E, "nu": nu, "AU": AU}
+    return {k: np.where(ok, v, np.nan) for k, v in derived.items()}
+
+def check_elastic_tensors(orig_dict: dict, confs: list, derived: bool = False) -> dict:
+    '''
+    Validate the elastic tensors of all models and confs by one validate_elastic_tensors() call, and with derived,
+    compute the derived properties by one derive_elastic_properties() call.
+    Return {(model, conf): {"problems": problems, property: value, ...}}, the problems are "shape" for the tensors
+    which are not 6x6 numbers, the properties in DERIVED_PROPERTIES are given if derived.
+    '''
+    import numpy as np
+    checks = {}
+    keys, tensors = [], []
+    for k, v in orig_dict.items():
+        for conf in confs:
+            try:
+                result = v[conf]["elastic_00"]["result"]
+            except (KeyError, TypeError):
+                continue
+            try:
+                tensor = np.asarray(result["elastic_tensor"], dtype=float)
+            except (KeyError, TypeError, ValueError):
+                tensor = None
+            if tensor is None or tensor.shape != (6, 6):
+                checks[(k, conf)] = {"problems": "shape"}
+                continue
+            keys.append((k, conf))
+            tensors.append(tensor)
+    if tensors:
+        stack = np.stack(tensors)
+        for key, problems in zip(keys, validate_elastic_tensors(stack)):
+            checks[key] = {"problems": problems}
+        if derived:
+            properties = derive_elastic_properties(stack)
+            for name in DERIVED_PROPERTIES:
+                for key, value in zip(keys, properties[name].tolist()):
+                    checks[key][name] = None if value != value else value
+    return checks
+
+def prep_elastic_content(orig_dict: dict, conf: str, checks: dict = None, exclude_invalid: bool = False, derived: bool = False, models: list = None) -> dict:
+    '''
+    checks: the problems of the elastic tensors, see check_elastic_tensors(), they are checked for this conf if not given
+    exclude_invalid: do not calculate the errors and CV of an invalid tensor, otherwise it is only flagged in "valid"
+    derived: also give the derived properties (see derive_elastic_properties()) and their relative errors, the DERIVED_METRICS columns
+    models: only give the rows of these models, the other datasets are only used as the references
+    '''
+    if checks is None:
+        checks = check_elastic_tensors(orig_dict, [conf], derived)
+    metrics = METRICS_LIST0 + DERIVED_METRICS if derived else METRICS_LIST0
     content_dict = {}
     idx = 3
     for k, v in orig_dict.items():
-        new_dict = {k: None for k in METRICS_LIST0}
+        if models is not None and k not in models:
+            continue
+        new_dict = {k: None for k in metrics}
 
         try:
             conf_info = v[conf]["relaxation"]["structure_info"]
@@ -852,6 +2064,20 @@ def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
                 new_dict["idx"] = idx
             continue
         else:
+            check = checks.get((k, conf), {})
+            problems = check.get("problems", "")
+            new_dict["valid"] = 0 if problems else 1
+            if problems:
+                print(f"Elastic tensor of {conf} in {k} is invalid: {problems}")
+            if problems == "shape":
+                # not a 6x6 tensor, nothing can be computed from it
+                content_dict[k] = new_dict
+                new_dict["idx"] = {"Expt": 0, "DFT(abacus)": 1, "single-dai": 2, "mace": 3}.get(k)
+                if new_dict["idx"] is None:
+                    idx += 1
+                    new_dict["idx"] = idx
+                continue
+
             tensor = elastic_data["elastic_tensor"]
             new_dict["c11"] = tensor[0][0]
             new_dict["c12"] = tensor[0][1]
@@ -898,7 +2124,9 @@ def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
                     print(f"DFT information GV is not in {conf} for calculating RE_GV_DFT of {k}")
 
             # CV based on Expt data
-            if k != 'Expt':
+            if k != 'Expt' and checks.get(('Expt', conf), {}).get("problems") == "shape":
+                print(f"Experimental elastic_tensor of {conf} is not 6x6 for calculating CV_Expt of {k}")
+            elif k != 'Expt':
                 try:
                     new_dict["CV_Expt"] = cal_cij_CV(tensor, orig_dict["Expt"][conf]["elastic_00"]["result"]["elastic_tensor"], \
                                                    orig_dict["DFT(abacus)"][conf]["relaxation"]["structure_info"]["point_group_symbol"])
@@ -910,7 +2138,9 @@ def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
                     print(f"Experimental information cij may be None in {conf} for calculating CV_Expt of {k}")
             
             # CV based on DFT data
-            if k != 'Expt' and k != 'DFT(abacus)':
+            if k != 'Expt' and k != 'DFT(abacus)' and checks.get(('DFT(abacus)', conf), {}).get("problems") == "shape":
+                print(f"DFT elastic_tensor of {conf} is not 6x6 for calculating CV_DFT of {k}")
+            elif k != 'Expt' and k != 'DFT(abacus)':
                 try:
                     new_dict["CV_DFT"] = cal_cij_CV(tensor, orig_dict["DFT(abacus)"][conf]["elastic_00"]["result"]["elastic_tensor"], \
                                                   orig_dict["DFT(abacus)"][conf]["relaxation"]["structure_info"]["point_group_symbol"])
@@ -918,6 +2148,24 @@ def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
                     new_dict["CV_DFT"] = None
                     print(f"DFT information elastic_tensor is not in {conf} for calculating CV_DFT of {k}")
 
+            # the derived properties are compared with the ones derived from the tensors of Expt and DFT(abacus)
+            if derived:
+                for name in DERIVED_PROPERTIES:
+                    new_dict[name] = check.get(name)
+                for name in DERIVED_RE:
+                    for ref, suffix in [("Expt", "Expt"), ("DFT(abacus)", "DFT")]:
+                        if k in ["Expt", ref]:
+                            continue
+                        ref_value = checks.get((ref, conf), {}).get(name)
+                        if check.get(name) is not None and ref_value:
+                            new_dict[f"RE_{name}_{suffix}"] = cal_relative_error(check[name], ref_value)
+
+            # an invalid tensor is not scored
+            if problems and exclude_invalid:
+                for key in ["RE_BV_Expt", "RE_BV_DFT", "RE_GV_Expt", "RE_GV_DFT", "CV_Expt", "CV_DFT"] + list(DERIVED_CRITERIA):
+                    if key in new_dict:
+                        new_dict[key] = None
+
             content_dict[k] = new_dict
         
         if k == 'Expt':
@@ -934,7 +2182,8 @@ def prep_elastic_content(orig_dict: dict, conf: str) -> dict:
 
     return content_dict
 
-def prep_elastic_dict(orig_dict: dict) -> list:
+@stage
+def prep_elastic_dict(orig_dict: dict, exclude_invalid: bool = False, derived: bool = False) -> list:
     all_confs = set()
     all_props = set()
 
@@ -945,89 +2194,225 @@ def prep_elastic_dict(orig_dict: dict) -> list:
     all_confs_list = list(all_confs)
     all_confs_list.sort()
 
+    # the tensors of all confs are checked at once
+    checks = check_elastic_tensors(orig_dict, all_confs_list, derived)
     confs_elastic_dict_list = []
     for conf in all_confs_list:
-        conf_dict = {
-            "type": "metrics",
-            "content": prep_elastic_content(orig_dict, conf),
-            "title": conf,
-            "criteria": {
-                "RE_BV_Expt": "abs(x) < 0.2",
-                "RE_GV_Expt": "abs(x) < 0.2",
-                "RE_BV_DFT": "abs(x) < 0.2",
-                "RE_GV_DFT": "abs(x) < 0.2",
-                "CV_Expt": "abs(x) < 0.2",
-                "CV_DFT": "abs(x) < 0.2",
-            },
-            "sort": ["idx"],
-            "metrics": METRICS_LIST0,
-        }
-        confs_elastic_dict_list.append(conf_dict)
+        confs_elastic_dict_list.append(prep_elastic_item(orig_dict, conf, checks, exclude_invalid, derived))
 
     return confs_elastic_dict_list
 
-def eval_CV_elastic(content: list) -> dict:
-    THRESHOLD = 0.2
+def prep_elastic_item(orig_dict: dict, conf: str, checks: dict = None, exclude_invalid: bool = False, derived: bool = False) -> dict:
+    return elastic_item(conf, prep_elastic_content(orig_dict, conf, checks, exclude_invalid, derived), derived)
 
-    all_models = set()
-    for w in content:
-        all_models.update(w["content"].keys())
-    all_models.remove("Expt")
-    all_models.remove("DFT(abacus)")
-    all_models_list = list(all_models)
-    all_models_list.sort()
+def elastic_item(conf: str, content: dict, derived: bool = False) -> dict:
+    conf_dict = {
+        "type": "metrics",
+        "content": content,
+        "title": conf,
+        "criteria": dict(ELASTIC_CRITERIA, **DERIVED_CRITERIA) if derived else ELASTIC_CRITERIA,
+        "sort": ["idx"],
+        "metrics": METRICS_LIST0 + DERIVED_METRICS if derived else METRICS_LIST0,
+    }
 
-    all_confs_num = len(content) # number of total confs
+    return conf_dict
 
-    content_dict = {}
+def _push_worst(heap: list, value, conf: str, top_n: int):
+    # keep the top_n largest (value, conf) in a min-heap, so the smallest of them is dropped first
+    if top_n <= 0 or value != value:
+        return
+    if len(heap) < top_n:
+        heapq.heappush(heap, (value, conf))
+    elif (value, conf) > heap[0]:
+        heapq.heapreplace(heap, (value, conf))
+
+class SummaryAccumulator:
+    '''
+    The mergeable summary of some metrics of each model over the confs, for eval_CV_elastic() and eval_MAE_eos().
+    For each (model, metric) the number of values, their sum, the pass number (value < threshold) and the top_n worst
+    (value, conf) are kept. The sum is kept as the exact partials of math.fsum(), so the summaries of the shards of
+    a conf set can be merged in any order and give exactly the same averages as one pass over all confs.
+    '''
+    __slots__ = ("metrics", "threshold", "top_n", "confs", "stat")
+
+    def __init__(self, metrics: list, threshold: float, top_n: int):
+        self.metrics = list(metrics)
+        self.threshold = threshold
+        self.top_n = top_n
+        self.confs = 0   # number of confs
+        self.stat = {}   # {model: {metric: [number, partials, pass number, worst heap, sum of inf/nan]}}
+
+    def add_model(self, model: str):
+        if model not in self.stat:
+            self.stat[model] = {m: [0, [], 0, [], 0.0] for m in self.metrics}
+
+    def add(self, model: str, metric: str, value: float, conf: str):
+        istat = self.stat[model][metric]
+        istat[0] += 1
+        if math.isfinite(value):
+            _add_partial(istat[1], value)
+        else:
+            istat[4] += value
+        istat[2] += int(value < self.threshold)
+        _push_worst(istat[3], value, conf, self.top_n)
+
+    def merge(self, other: "SummaryAccumulator"):
+        self.confs += other.confs
+        self.top_n = min(self.top_n, other.top_n)
+        for model, metrics in other.stat.items():
+            self.add_model(model)
+            for metric, (num, partials, pass_num, worst, special) in metrics.items():
+                istat = self.stat[model][metric]
+                istat[0] += num
+                for x in partials:
+                    _add_partial(istat[1], x)
+                istat[2] += pass_num
+                istat[4] += special
+                for value, conf in worst:
+                    _push_worst(istat[3], value, conf, self.top_n)
+        for metrics in self.stat.values():
+            for istat in metrics.values():
+                while len(istat[3]) > self.top_n:
+                    heapq.heappop(istat[3])
+        return self
+
+    def models(self) -> list:
+        return sorted(self.stat.keys())
+
+    def average(self, model: str, metric: str):
+        num, partials, _, _, special = self.stat[model][metric]
+        return (math.fsum(partials) + special) / num if num else None
+
+    def total(self, model: str, metric: str) -> float:
+        _, partials, _, _, special = self.stat[model][metric]
+        return math.fsum(partials) + special
+
+    def pass_num(self, model: str, metric: str) -> int:
+        return self.stat[model][metric][2]
+
+    def worst(self, model: str, metric: str) -> list:
+        return sorted(self.stat[model][metric][3], reverse=True)
+
+    def to_dict(self) -> dict:
+        return {"metrics": self.metrics, "threshold": self.threshold, "top_n": self.top_n, "confs": self.confs, "stat": self.stat}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SummaryAccumulator":
+        acc = cls(d["metrics"], d["threshold"], d["top_n"])
+        acc.confs = d["confs"]
+        for model, metrics in d["stat"].items():
+            acc.stat[model] = {m: [num, list(partials), pass_num, [tuple(w) for w in worst], special]
+                               for m, (num, partials, pass_num, worst, special) in metrics.items()}
+            for istat in acc.stat[model].values():
+                heapq.heapify(istat[3])
+        return acc
+
+def _add_partial(partials: list, x: float):
+    # add x to the non-overlapping partials of an exact sum, as math.fsum() does
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+def _summary_idx(all_models_list: list) -> dict:
+    # the rows of the summaries are sorted by idx, single-dai and mace go first
+    idx_dict = {}
     idx = 1
     for k in all_models_list:
-        new_dict = {k: 0 for k in METRICS_LIST1}
-        content_dict[k] = new_dict
-
         if k == 'single-dai':
-            content_dict[k]["idx"] = 0
+            idx_dict[k] = 0
         elif k == 'mace':
-            content_dict[k]["idx"] = 1
+            idx_dict[k] = 1
         else:
             idx += 1
-            content_dict[k]["idx"] = idx
-    
+            idx_dict[k] = idx
+    return idx_dict
+
+def accumulate_CV_elastic(content: list, top_n: int = None) -> SummaryAccumulator:
+    # CV_Expt/DFT substitutes CV_DFT for CV_Expt if CV_Expt is None
+    # if the derived properties are computed, the absolute values of their relative errors (DERIVED_CRITERIA) are also summarized
+    if top_n is None: top_n = TOP_N_WORST
+    derived = any(m in v for item in content for v in item.get("content", {}).values() for m in DERIVED_CRITERIA)
+    derived_metrics = list(DERIVED_CRITERIA) if derived else []
+    acc = SummaryAccumulator(["CV_Expt/DFT", "CV_DFT", "invalid"] + derived_metrics, 0.2, top_n)
+    for item in content:
+        acc.confs += 1
+        conf = item.get("title","")
+        for k, v in item.get("content","").items():
+            if k in ["Expt", "DFT(abacus)"]:
+                continue
+            acc.add_model(k)
+            CV_Expt = v["CV_Expt"] if v["CV_Expt"] != None else v["CV_DFT"]
+            invalid = None if v.get("valid") is None else 1 - v["valid"]
+            for key, value in [("CV_Expt/DFT", CV_Expt), ("CV_DFT", v["CV_DFT"]), ("invalid", invalid)]:
+                if value is not None:
+                    acc.add(k, key, value, conf)
+            for key in derived_metrics:
+                if v.get(key) is not None:
+                    acc.add(k, key, abs(v[key]), conf)
+    return acc
+
+def eval_CV_elastic(content: list, top_n: int = None, summary: SummaryAccumulator = None) -> dict:
+    '''
+    Summarize the CV of each model over all confs in one pass over content, or from summary (see accumulate_CV_elastic()) if given.
+    The top_n confs with the largest CV of each model are also kept (in bounded heaps), in "worst" of the returned dict:
+    {model: {"CV_Expt/DFT": [(value, conf), ...], "CV_DFT": [...]}}, from the worst one.
+    '''
+    if summary is None:
+        summary = accumulate_CV_elastic(content, top_n)
+    all_models_list = summary.models()
+    all_confs_num = summary.confs # number of total confs
+    idx_dict = _summary_idx(all_models_list)
+    derived_metrics = [m for m in summary.metrics if m in DERIVED_CRITERIA]
+    metrics = METRICS_LIST1 + [c for m in derived_metrics for c in [f"{m}_pass_num", f"Aver_|{m}|"]]
+
+    content_dict = {}
+    worst = {}
     for model_type in all_models_list:
-        CV_Expt_list = []
-        CV_DFT_list = []
-        for item in content:
-            icontent = item.get("content","")
-            for k, v in icontent.items():
-                if k == model_type:
-                    if v["CV_Expt"] != None:
-                        CV_Expt_list.append(v["CV_Expt"])
-                    else:
-                        CV_Expt_list.append(v["CV_DFT"])
-                    
-                    CV_DFT_list.append(v["CV_DFT"])
-        
-        filtered_CV_Expt_list = [item for item in CV_Expt_list if item is not None]
-        filtered_CV_DFT_list = [item for item in CV_DFT_list if item is not None]
-        content_dict[model_type]["CV_Expt/DFT_pass_num"] = str(sum(1 for x in filtered_CV_Expt_list if x < THRESHOLD)) + "/" + str(all_confs_num)
-        content_dict[model_type]["CV_DFT_pass_num"] = str(sum(1 for x in filtered_CV_DFT_list if x < THRESHOLD)) + "/" + str(all_confs_num)
-        content_dict[model_type]["Aver_CV_Expt/DFT"] = sum(filtered_CV_Expt_list) / len(filtered_CV_Expt_list)
-        content_dict[model_type]["Aver_CV_DFT"] = sum(filtered_CV_DFT_list) / len(filtered_CV_DFT_list)
+        content_dict[model_type] = {k: 0 for k in METRICS_LIST1}
+        content_dict[model_type]["idx"] = idx_dict[model_type]
+        worst[model_type] = {}
+        for key in ["CV_Expt/DFT", "CV_DFT"]:
+            content_dict[model_type][f"{key}_pass_num"] = str(summary.pass_num(model_type, key)) + "/" + str(all_confs_num)
+            content_dict[model_type][f"Aver_{key}"] = summary.average(model_type, key)
+            worst[model_type][key] = summary.worst(model_type, key)
+        content_dict[model_type]["invalid_num"] = round(summary.total(model_type, "invalid"))
+        for key in derived_metrics:
+            content_dict[model_type][f"{key}_pass_num"] = str(summary.pass_num(model_type, key)) + "/" + str(all_confs_num)
+            content_dict[model_type][f"Aver_|{key}|"] = summary.average(model_type, key)
 
     eval_CV_elastic_inf = {
         "type": "metrics",
         "title": "Evaluation of models by CV values of cij (CV < 0.2) (Note: substituting CV_DFT for CV_Expt, if CV_Expt is None)",
         "content": content_dict,
         "sort": ["idx"],
-        "metrics": METRICS_LIST1,
+        "metrics": metrics,
+        "worst": worst,
     }
 
     return eval_CV_elastic_inf
 
-def prep_eos_content(orig_dict: dict, conf: str) -> dict:
+def _eos_volumes(eos_result: dict) -> list:
+    # the keys of eos result are the volumes, fall back to the point index if they are not numbers
+    try:
+        return [float(v) for v in eos_result.keys()]
+    except (TypeError, ValueError):
+        return list(range(1, len(eos_result) + 1))
+
+def prep_eos_content(orig_dict: dict, conf: str, volumes: dict = None, models: list = None) -> dict:
+    import numpy as np
     content_dict = {}
     idx = 2
     for k, v in orig_dict.items():
+        if models is not None and k not in models:
+            continue
         new_dict = {k: None for k in METRICS_LIST2}
 
         if k != 'Expt':
@@ -1064,6 +2449,8 @@ def prep_eos_content(orig_dict: dict, conf: str) -> dict:
                 new_dict["eos14"] = eos_data[13]
                 new_dict["eos15"] = eos_data[14]
                 new_dict["eos16"] = eos_data[15]
+                if volumes is not None:
+                    volumes[k] = _eos_volumes(v[conf]["eos_00"]["result"])
 
             if k != 'DFT(abacus)':
                 predicted = np.array(eos_data)
@@ -1088,6 +2475,7 @@ def prep_eos_content(orig_dict: dict, conf: str) -> dict:
 
     return content_dict
 
+@stage
 def prep_eos_dict(orig_dict: dict) -> list:
     all_confs = set()
     all_props = set()
@@ -1101,57 +2489,61 @@ def prep_eos_dict(orig_dict: dict) -> list:
 
     confs_eos_dict_list = []
     for conf in all_confs_list:
-        conf_dict = {
-            "type": "metrics",
-            "content": prep_eos_content(orig_dict, conf),
-            "title": conf,
-            "criteria": {
-                "MAE_DFT": "abs(x) < 0.1",
-            },
-            "sort": ["idx"],
-            "metrics": METRICS_LIST2,
-        }
-        confs_eos_dict_list.append(conf_dict)
+        confs_eos_dict_list.append(prep_eos_item(orig_dict, conf))
 
     return confs_eos_dict_list
 
-def eval_MAE_eos(content: list) -> dict:
-    THRESHOLD = 0.1
+def prep_eos_item(orig_dict: dict, conf: str) -> dict:
+    volumes = {}
+    content = prep_eos_content(orig_dict, conf, volumes)
+    return eos_item(conf, content, volumes)
 
-    all_models = set()
-    for w in content:
-        all_models.update(w["content"].keys())
-    all_models.remove("DFT(abacus)")
-    all_models_list = list(all_models)
-    all_models_list.sort()
+def eos_item(conf: str, content: dict, volumes: dict) -> dict:
+    conf_dict = {
+        "type": "metrics",
+        "content": content,
+        "volumes": volumes,
+        "title": conf,
+        "criteria": EOS_CRITERIA,
+        "sort": ["idx"],
+        "metrics": METRICS_LIST2,
+    }
 
-    all_confs_num = len(content) # number of total confs
+    return conf_dict
 
-    content_dict = {}
-    idx = 1
-    for k in all_models_list:
-        new_dict = {k: 0 for k in METRICS_LIST3}
-        content_dict[k] = new_dict
+def accumulate_MAE_eos(content: list, top_n: int = None) -> SummaryAccumulator:
+    if top_n is None: top_n = TOP_N_WORST
+    acc = SummaryAccumulator(["MAE_DFT"], 0.1, top_n)
+    for item in content:
+        acc.confs += 1
+        conf = item.get("title","")
+        for k, v in item.get("content","").items():
+            if k == "DFT(abacus)":
+                continue
+            acc.add_model(k)
+            if v["MAE_DFT"] is not None:
+                acc.add(k, "MAE_DFT", v["MAE_DFT"], conf)
+    return acc
 
-        if k == 'single-dai':
-            content_dict[k]["idx"] = 0
-        elif k == 'mace':
-            content_dict[k]["idx"] = 1
-        else:
-            idx += 1
-            content_dict[k]["idx"] = idx
-    
+def eval_MAE_eos(content: list, top_n: int = None, summary: SummaryAccumulator = None) -> dict:
+    '''
+    Summarize the MAE of each model over all confs in one pass over content, or from summary (see accumulate_MAE_eos()) if given.
+    The top_n confs with the largest MAE of each model are in "worst" of the returned dict: {model: {"MAE_DFT": [(value, conf), ...]}}
+    '''
+    if summary is None:
+        summary = accumulate_MAE_eos(content, top_n)
+    all_models_list = summary.models()
+    all_confs_num = summary.confs # number of total confs
+    idx_dict = _summary_idx(all_models_list)
+
+    content_dict = {}
+    worst = {}
     for model_type in all_models_list:
-        MAE_DFT_list = []
-        for item in content:
-            icontent = item.get("content","")
-            for k, v in icontent.items():
-                if k == model_type:
-                    MAE_DFT_list.append(v["MAE_DFT"])
-        
-        filtered_MAE_DFT_list = [item for item in MAE_DFT_list if item is not None]
-        content_dict[model_type]["MAE_DFT_pass_num"] = str(sum(1 for x in filtered_MAE_DFT_list if x < THRESHOLD)) + "/" + str(all_confs_num)
-        content_dict[model_type]["Aver_MAE_DFT"] = sum(filtered_MAE_DFT_list) / len(filtered_MAE_DFT_list)
+        content_dict[model_type] = {k: 0 for k in METRICS_LIST3}
+        content_dict[model_type]["idx"] = idx_dict[model_type]
+        content_dict[model_type]["MAE_DFT_pass_num"] = str(summary.pass_num(model_type, "MAE_DFT")) + "/" + str(all_confs_num)
+        content_dict[model_type]["Aver_MAE_DFT"] = summary.average(model_type, "MAE_DFT")
+        worst[model_type] = {"MAE_DFT": summary.worst(model_type, "MAE_DFT")}
 
     eval_AE_eos_inf = {
         "type": "metrics",
@@ -1159,10 +2551,342 @@ def eval_MAE_eos(content: list) -> dict:
         "content": content_dict,
         "sort": ["idx"],
         "metrics": METRICS_LIST3,
+        "worst": worst,
     }
 
     return eval_AE_eos_inf
 
+def prep_worst_confs(eval_CV_elastic_inf: dict, eval_MAE_eos_inf: dict) -> list:
+    '''
+    One table for each model listing its worst confs by CV_Expt/DFT, CV_DFT and MAE_DFT, from "worst" of the summaries
+    '''
+    criteria = {"CV_Expt/DFT": "abs(x) < 0.2", "CV_DFT": "abs(x) < 0.2", "MAE_DFT": "abs(x) < 0.1"}
+    worst = {}
+    for inf in [eval_CV_elastic_inf, eval_MAE_eos_inf]:
+        for k, v in inf.get("worst", {}).items():
+            worst.setdefault(k, {}).update(v)
+
+    first = ['single-dai', 'mace']
+    worst_dict_list = []
+    for k in sorted(worst.keys(), key=lambda k: (first.index(k) if k in first else len(first), k)):
+        content_dict = {}
+        for key, values in worst[k].items():
+            for rank, (value, conf) in enumerate(values, 1):
+                content_dict.setdefault(rank, {})[f"{key}_conf"] = conf
+                content_dict[rank][key] = value
+        if not content_dict:
+            continue
+        worst_dict_list.append({
+            "type": "metrics",
+            "title": f"The worst confs of {k}",
+            "content": content_dict,
+            "criteria": criteria,
+        })
+
+    return worst_dict_list
+
+def metric_matrix(content: list, metric: str, models: list = None) -> tuple:
+    '''
+    Stack one metric of the per-conf items (content of prep_elastic_dict or prep_eos_dict) into a matrix.
+    Return (confs, models, matrix), the matrix is (number of confs, number of models) with NaN for the missing values.
+    models: the columns, default is all models of content except the references, single-dai and mace first
+    '''
+    import numpy as np
+    if models is None:
+        all_models = set()
+        for item in content:
+            all_models.update(item["content"].keys())
+        all_models -= {"Expt", "DFT(abacus)"}
+        first = ['single-dai', 'mace']
+        models = sorted(all_models, key=lambda k: (first.index(k) if k in first else len(first), k))
+    column = {k: j for j, k in enumerate(models)}
+    confs = [item["title"] for item in content]
+    matrix = np.full((len(confs), len(models)), np.nan)
+    for i, item in enumerate(content):
+        for k, v in item["content"].items():
+            value = v.get(metric)
+            if k in column and isinstance(value, numbers.Real):
+                matrix[i, column[k]] = value
+    return confs, models, matrix
+
+def prep_overview(elastic_dict_list: list, eos_dict_list: list, sort: str = "difficulty") -> list:
+    '''
+    Heatmaps of CV_DFT, CV_Expt and MAE_DFT of all confs and models, the colors are in the unit of the thresholds.
+    sort: the order of the confs, see order_rows()
+    '''
+    svgs = []
+    for content, metric, threshold in [(elastic_dict_list, "CV_DFT", 0.2), (elastic_dict_list, "CV_Expt", 0.2), (eos_dict_list, "MAE_DFT", 0.1)]:
+        confs, models, matrix = metric_matrix(content, metric)
+        if not confs or not models:
+            continue
+        ratio = matrix / threshold
+        order = order_rows(ratio, sort)
+        svgs.append(svg_heatmap(ratio[order], [confs[i] for i in order], models, title=metric, threshold=threshold))
+    if not svgs:
+        return []
+
+    order_text = {"difficulty": "the confs with the largest average over the models first",
+                  "cluster": "the confs with similar values close to each other",
+                  }.get(sort, "the confs in the order of names")
+    return [
+        {"type": "text", "content": f"The conf × model overview of the metrics, green is 0, yellow is the threshold and red is twice the threshold or larger. The rows are sorted by {order_text}."},
+        {"type": "svg", "content": svgs},
+    ]
+
+def summary_groups(confs: list, group_by: list, simplified_dataset: dict = None) -> dict:
+    '''
+    The group_by argument of assemble_report() for the --group-by arguments, {title: {conf: [group, ...]}}
+    '''
+    return {f"Summary by {os.path.basename(by)}": conf_groups(confs, by, simplified_dataset) for by in group_by or []}
+
+def _formula_elements(comp: str) -> list:
+    '''
+    The sorted elements of a conf path component which is a formula, e.g. AlCu or Al2O3, or None if it is not.
+    Every symbol must be an element, and a single element with a count (e.g. B2, C14) is taken as the name of a prototype.
+    '''
+    tokens = FORMULA_RE.fullmatch(comp) and re.findall(r"([A-Z][a-z]?)(\d*(?:\.\d+)?)", comp)
+    if not tokens or any(symbol not in ELEMENTS for symbol, _ in tokens):
+        return None
+    if len(tokens) == 1 and tokens[0][1]:
+        return None
+    return sorted(set(symbol for symbol, _ in tokens))
+
+def conf_groups(confs: list, by: str, simplified_dataset: dict = None) -> dict:
+    '''
+    The groups of each conf {conf: [group, ...]}, by:
+      "point_group": the point group of the conf (see _point_groups()), from simplified_dataset
+      "element": the elements of the first component of the conf path which is a formula (see _formula_elements()),
+                 e.g. confs/AlCu/fcc -> Al, Cu
+      a json file {conf: group or [groups]}, or a csv file with the conf in the first column and the group in the second one
+    The confs without a group are in the group "other".
+    '''
+    if by == "point_group":
+        point_groups = _point_groups(simplified_dataset or {})
+        return {conf: [point_groups.get(conf, "other")] for conf in confs}
+    if by == "element":
+        groups = {}
+        for conf in confs:
+            elements = next(filter(None, map(_formula_elements, conf.split("/"))), None)
+            groups[conf] = elements or ["other"]
+        return groups
+
+    if by.endswith(".json"):
+        with open(by) as f:
+            mapping = json.load(f)
+    else:
+        import csv
+        with open(by, newline="") as f:
+            mapping = {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2}
+    groups = {}
+    for conf in confs:
+        group = mapping.get(conf, "other")
+        groups[conf] = [str(g) for g in group] if isinstance(group, list) else [str(group)]
+    return groups
+
+def group_reduce(matrix, group_index, ngroups: int, threshold: float) -> tuple:
+    '''
+    Reduce the rows of a metric matrix (confs, models) in groups by bincount, group_index is the group of each row.
+    Return (number of values, sum, pass number (value < threshold)), each of them is (ngroups, models).
+    '''
+    import numpy as np
+    ncols = matrix.shape[1]
+    flat = (np.asarray(group_index)[:, None] * ncols + np.arange(ncols)).ravel()
+    values = matrix.ravel()
+    valid = ~np.isnan(values)
+    size = ngroups * ncols
+    num = np.bincount(flat, weights=valid, minlength=size).reshape(ngroups, ncols)
+    total = np.bincount(flat, weights=np.where(valid, values, 0.0), minlength=size).reshape(ngroups, ncols)
+    with np.errstate(invalid="ignore"):
+        passed = np.bincount(flat, weights=valid & (values < threshold), minlength=size).reshape(ngroups, ncols)
+    return num, total, passed
+
+def prep_group_summary(elastic_dict_list: list, eos_dict_list: list, groups: dict, title: str) -> list:
+    '''
+    The summaries of eval_CV_elastic() and eval_MAE_eos() for each group of confs, one table for each model with the groups as rows.
+    groups: {conf: [group, ...]} (see conf_groups()), a conf in several groups is counted in each of them
+    '''
+    import numpy as np
+    group_names = sorted(set(g for gs in groups.values() for g in gs), key=lambda g: (g == "other", g))
+    group_id = {g: i for i, g in enumerate(group_names)}
+
+    stats = {}  # {model: {group: {column: value}}}
+    for content, key, metric, threshold in [(elastic_dict_list, "CV_Expt/DFT", "CV_Expt", 0.2), (elastic_dict_list, "CV_DFT", "CV_DFT", 0.2),
+                                            (eos_dict_list, "MAE_DFT", "MAE_DFT", 0.1)]:
+        confs, models, matrix = metric_matrix(content, metric)
+        if not confs or not models:
+            continue
+        if key == "CV_Expt/DFT":
+            # substituting CV_DFT for CV_Expt, as eval_CV_elastic() does
+            matrix = np.where(np.isnan(matrix), metric_matrix(content, "CV_DFT", models)[2], matrix)
+        # a conf in several groups gives a row for each of them
+        rows = [i for i, conf in enumerate(confs) for _ in groups.get(conf, ["other"])]
+        group_index = [group_id[g] for conf in confs for g in groups.get(conf, ["other"])]
+        num, total, passed = group_reduce(matrix[rows], group_index, len(group_names), threshold)
+        confs_num = np.bincount(group_index, minlength=len(group_names))
+        for j, model in enumerate(models):
+            for i, group in enumerate(group_names):
+                if confs_num[i] == 0:
+                    continue
+                row = stats.setdefault(model, {}).setdefault(group, {"confs": int(confs_num[i])})
+                row[f"{key}_pass_num"] = f"{int(passed[i, j])}/{int(confs_num[i])}"
+                row[f"Aver_{key}"] = total[i, j] / num[i, j] if num[i, j] else None
+
+    first = ['single-dai', 'mace']
+    items = [{"type": "head2", "content": title}]
+    for model in sorted(stats, key=lambda k: (first.index(k) if k in first else len(first), k)):
+        content_dict = stats[model]
+        for i, group in enumerate(group_names):
+            if group in content_dict:
+                content_dict[group]["idx"] = i
+        items.append({
+            "type": "metrics",
+            "title": f"{model}",
+            "content": content_dict,
+            "sort": ["idx"],
+            "metrics": ["idx", "confs"] + [m for m in GROUP_METRICS if any(m in v for v in content_dict.values())],
+            "criteria": {"Aver_CV_Expt/DFT": "abs(x) < 0.2", "Aver_CV_DFT": "abs(x) < 0.2", "Aver_MAE_DFT": "abs(x) < 0.1"},
+        })
+    return items
+
+def pivot_by_model(content: list, metrics: list, criteria: dict) -> list:
+    '''
+    Pivot the per-conf items (content of prep_elastic_dict or prep_eos_dict) to per-model items: one table for each model,
+    with all confs as rows. The "pass" column tells if the model passes all criteria of the conf.
+    The reference data (Expt and DFT(abacus)) are not listed.
+    '''
+    model_metrics = [m for m in metrics if m != "idx"]
+    model_dict = {}
+    for item in content:
+        conf = item["title"]
+        for k, v in item["content"].items():
+            if k in ['Expt', 'DFT(abacus)']:
+                continue
+            row = {m: v.get(m) for m in model_metrics}
+            judges = [judge_metric(v[m], c) for m, c in criteria.items() if v.get(m) is not None]
+            row["pass"] = all(judges) if judges else None
+            model_dict.setdefault(k, {})[conf] = row
+
+    first = ['single-dai', 'mace']
+    model_dict_list = []
+    for k in sorted(model_dict.keys(), key=lambda k: (first.index(k) if k in first else len(first), k)):
+        model_dict_list.append({
+            "type": "metrics",
+            "content": model_dict[k],
+            "title": k,
+            "criteria": dict(criteria, **{"pass": "x == 1"}),
+            "metrics": model_metrics + ["pass"],
+        })
+
+    return model_dict_list
+
+def _model_colors(content: list) -> dict:
+    # fix the color of each model, so that a model has the same color in all plots
+    all_models = set()
+    for w in content:
+        all_models.update(w["content"].keys())
+    first = ['Expt', 'DFT(abacus)', 'single-dai', 'mace']
+    all_models_list = sorted(all_models, key=lambda k: (first.index(k) if k in first else len(first), k))
+    return {k: PLOT_COLORS[i % len(PLOT_COLORS)] for i, k in enumerate(all_models_list)}
+
+def prep_elastic_plots(content: list) -> dict:
+    '''
+    Parity plots of BV, GV and cij of each model against the DFT and experimental data
+    '''
+    colors = _model_colors(content)
+    cij_keys = ["c11", "c12", "c13", "c33", "c44", "c66"]
+    parity = {}  # {(quantity, reference): {model: ([reference values], [predicted values])}}
+    for item in content:
+        icontent = item["content"]
+        for ref in ['DFT(abacus)', 'Expt']:
+            ref_dict = icontent.get(ref)
+            if not ref_dict:
+                continue
+            for k, v in icontent.items():
+                if k in [ref, 'Expt']:
+                    continue
+                for quantity, keys in [("BV", ["BV"]), ("GV", ["GV"]), ("Cij", cij_keys)]:
+                    xs, ys = parity.setdefault((quantity, ref), {}).setdefault(k, ([], []))
+                    for ikey in keys:
+                        if v.get(ikey) is not None and ref_dict.get(ikey) is not None:
+                            xs.append(ref_dict[ikey])
+                            ys.append(v[ikey])
+
+    svgs = []
+    for ref in ['DFT(abacus)', 'Expt']:
+        for quantity in ["BV", "GV", "Cij"]:
+            series = [(k, xs, ys) for k, (xs, ys) in parity.get((quantity, ref), {}).items() if xs]
+            svgs.append(svg_plot(series, title=f"{quantity} vs {ref}", xlabel=f"{quantity} of {ref} (GPa)", ylabel=f"Predicted {quantity} (GPa)",
+                                 colors=colors, diagonal=True))
+
+    plot_inf = {
+        "type": "svg",
+        "title": "Parity plots of the elastic properties",
+        "content": svgs,
+    }
+
+    return plot_inf
+
+def prep_cv_histograms(content: list) -> dict:
+    '''
+    Histograms of CV_Expt and CV_DFT for each model, all models share the same bins
+    '''
+    import numpy as np
+    THRESHOLD = 0.2
+
+    cv_values = {}
+    for item in content:
+        for k, v in item["content"].items():
+            if k in ['Expt', 'DFT(abacus)']:
+                continue
+            icv = cv_values.setdefault(k, {"CV_Expt": [], "CV_DFT": []})
+            for key in icv:
+                if v.get(key) is not None:
+                    icv[key].append(v[key])
+
+    all_values = np.array([x for icv in cv_values.values() for ilist in icv.values() for x in ilist], dtype=float)
+    all_values = all_values[np.isfinite(all_values)]
+    if all_values.size == 0:
+        return {"type": "svg", "content": []}
+    # values larger than the upper edge are counted in the last bin
+    upper = max(2 * THRESHOLD, float(np.quantile(all_values, 0.99)))
+    edges = np.linspace(0, upper, 21)
+
+    svgs = []
+    for k in sorted(cv_values.keys()):
+        series = []
+        for key, values in cv_values[k].items():
+            values = np.clip(np.array(values, dtype=float), 0, upper)
+            counts, _ = np.histogram(values[np.isfinite(values)], bins=edges)
+            series.append((key, edges, counts))
+        svgs.append(svg_plot(series, title=k, xlabel="CV", ylabel="Number of confs", mode="bar",
+                             colors={"CV_Expt": PLOT_COLORS[0], "CV_DFT": PLOT_COLORS[1]}, vline=THRESHOLD))
+
+    plot_inf = {
+        "type": "svg",
+        "title": "Distribution of CV values of each model (the dashed line is the threshold 0.2)",
+        "content": svgs,
+    }
+
+    return plot_inf
+
+def prep_eos_plot(conf_dict: dict, colors: dict = None) -> dict:
+    '''
+    EOS curves of all models for one conf
+    '''
+    import numpy as np
+    eos_keys = [f"eos{i}" for i in range(1, 17)]
+    series = []
+    for k, volumes in conf_dict.get("volumes", {}).items():
+        energies = [conf_dict["content"][k][ikey] for ikey in eos_keys]
+        series.append((k, volumes, [np.nan if e is None else e for e in energies]))
+
+    plot_inf = {
+        "type": "svg",
+        "content": svg_plot(series, title=conf_dict.get("title", ""), xlabel="Volume", ylabel="Energy", mode="line", colors=colors),
+    }
+
+    return plot_inf
+
 def prep_head1(inf):
     head_inf = {
         "type": "head1",
@@ -1202,8 +2926,83 @@ def prep_text_eos():
 
     return text_inf
 
-def main():
-    input_path_list = sys.argv[1:]
+def json_decoders() -> dict:
+    '''
+    The available JSON decoders {name: loads(bytes)}, the fastest one first.
+    orjson and ujson are used if installed, "json" is the standard library, they all give plain dicts and lists,
+    which is all the report needs. "monty" also reconstructs the MSONable objects as loadfn() does.
+    '''
+    decoders = {}
+    try:
+        import orjson
+        decoders["orjson"] = _with_fallback(orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        decoders["ujson"] = _with_fallback(ujson.loads)
+    except ImportError:
+        pass
+    decoders["json"] = json.loads
+    decoders["monty"] = _monty_loads
+    return decoders
+
+def _with_fallback(loads):
+    # NaN and Infinity written by the json module are rejected by the fast decoders, decode such files by json
+    def fallback_loads(raw):
+        try:
+            return loads(raw)
+        except ValueError:
+            return json.loads(raw)
+    return fallback_loads
+
+def _monty_loads(raw):
+    from monty.json import MontyDecoder
+    return json.loads(raw, cls=MontyDecoder)
+
+def get_decoder(name: str = None):
+    decoders = json_decoders()
+    if name in [None, "auto"]:
+        return next(iter(decoders.values()))
+    if name not in decoders:
+        raise ValueError(f"JSON decoder {name} is not available, the available ones are: {', '.join(decoders)}")
+    return decoders[name]
+
+def read_json_bytes(path: str) -> bytes:
+    # the compressed archives, e.g. all_result.json.gz, are decompressed by the suffix
+    opener = ARCHIVE_OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, "rb") as f:
+        return f.read()
+
+def load_json(path: str, decoder: str = None):
+    return get_decoder(decoder)(read_json_bytes(path))
+
+def bench_decoders(file_path_list: list, repeat: int = 3) -> Table:
+    '''
+    Decode the archives with each available decoder, the best time of repeat runs is taken.
+    The reading and decompression is timed separately, as it is shared by all decoders.
+    '''
+    t0 = time.perf_counter()
+    raw_list = [read_json_bytes(p) for p in file_path_list]
+    read_time = time.perf_counter() - t0
+    size = sum(len(raw) for raw in raw_list)
+
+    rows = [["read", read_time, size / read_time / 1e6 if read_time else None, None]]
+    for name, loads in json_decoders().items():
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for raw in raw_list:
+                loads(raw)
+            cost = time.perf_counter() - t0
+            best = cost if best is None else min(best, cost)
+        rows.append([name, best, size / best / 1e6 if best else None, None])
+    base = rows[-1][1]
+    for row in rows[1:]:
+        row[3] = base / row[1] if row[1] else None
+    return Table.from_rows([["decoder", "seconds", "MB/s", "speedup_vs_monty"]] + rows)
+
+def collect_paths(input_path_list: list) -> list:
     path_list = []
     for ii in input_path_list:
         glob_list = glob.glob(os.path.abspath(ii))
@@ -1224,51 +3023,1381 @@ def main():
         raise FileNotFoundError(
             'all_result.json not exist!'
         )
-    
+    return file_path_list
+
+def _archive_key(path: str) -> tuple:
+    # an archive is regarded as unchanged if its path, modification time and size are unchanged
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+class Selection:
+    '''
+    The models, confs, point groups and properties selected for the report.
+    models/exclude_models: glob patterns matched against the tag, the work path and the file path of an archive
+    confs/exclude_confs: regular expressions searched in the conf names
+    point_groups: the point groups of the confs, taken from the reference data (see _point_groups())
+    properties: the property prefixes to keep, e.g. ["elastic"] keeps elastic_00, the relaxation is always kept
+    shard: (i, n) keeps the i-th (from 1) of n disjoint shards of the confs, split by the hash of the conf names
+    An archive excluded by its file path is not decoded, only its first SNIFF_BYTES bytes are read to find whether it is
+    a reference dataset. The excluded confs and properties of the other archives are dropped right after decoding,
+    so that they are never processed.
+    The reference datasets (REFERENCE_TAGS) are always kept, as all models are compared with them.
+    '''
+    __slots__ = ("models", "exclude_models", "confs", "exclude_confs", "point_groups", "properties", "shard")
+
+    def __init__(self, models=None, exclude_models=None, confs=None, exclude_confs=None, point_groups=None, properties=None, shard=None):
+        self.models = list(models or [])
+        self.exclude_models = list(exclude_models or [])
+        self.confs = re.compile(confs) if confs else None
+        self.exclude_confs = re.compile(exclude_confs) if exclude_confs else None
+        self.point_groups = set(point_groups or [])
+        self.properties = list(properties or [])
+        self.shard = shard
+
+    def __bool__(self):
+        return bool(self.models or self.exclude_models or self.confs or self.exclude_confs or self.point_groups or self.properties or self.shard)
+
+    def key(self) -> str:
+        # identifies the selection in the cache keys
+        return repr((self.models, self.exclude_models, self.confs and self.confs.pattern,
+                     self.exclude_confs and self.exclude_confs.pattern, sorted(self.point_groups), self.properties, self.shard))
+
+    def keep_path(self, path: str) -> bool:
+        # decided before the archive is read, only the exclusion can be decided by the file path,
+        # only the head of an excluded archive is read to find whether it is a reference dataset, which is warned by keep_model()
+        return not any(fnmatch.fnmatch(path, p) for p in self.exclude_models) or _sniff_reference(path)
+
+    def keep_model(self, names: list, reference: bool = False) -> bool:
+        names = [n for n in names if n]
+        if reference:
+            if any(fnmatch.fnmatch(n, p) for n in names for p in self.exclude_models):
+                print(f"Warning: {names[0]} is a reference dataset, it is kept although it matches --exclude-model")
+            return True
+        if any(fnmatch.fnmatch(n, p) for n in names for p in self.exclude_models):
+            return False
+        return not self.models or any(fnmatch.fnmatch(n, p) for n in names for p in self.models)
+
+    def keep_conf(self, conf: str) -> bool:
+        if self.shard and zlib.crc32(conf.encode()) % self.shard[1] != self.shard[0] - 1:
+            return False
+        if self.confs and not self.confs.search(conf):
+            return False
+        return not (self.exclude_confs and self.exclude_confs.search(conf))
+
+    def keep_property(self, prop: str) -> bool:
+        return prop == "relaxation" or not self.properties or prop.split("_")[0] in self.properties
+
+    def apply(self, path: str, archive: tuple):
+        '''
+        Return the selected part of an archive (work_path, data), or None if the model is not selected
+        '''
+        workdir_id, data_dict = archive
+        if not self.keep_model([data_dict.get("tag"), workdir_id, path], data_dict.get("tag") in REFERENCE_TAGS):
+            return None
+        selected = {}
+        for conf, v in data_dict.items():
+            if not isinstance(v, dict):
+                selected[conf] = v
+            elif self.keep_conf(conf):
+                selected[conf] = {prop: pv for prop, pv in v.items() if self.keep_property(prop)}
+        return (workdir_id, selected)
+
+    def select_point_groups(self, simplified_dataset: dict) -> dict:
+        # the point group of a conf may differ among the models, so it is decided by the reference data of the whole dataset
+        if not self.point_groups:
+            return simplified_dataset
+        point_groups = _point_groups(simplified_dataset)
+        return {k: {conf: v for conf, v in w.items() if not isinstance(v, dict) or point_groups.get(conf) in self.point_groups}
+                for k, w in simplified_dataset.items()}
+
+class Deduplicator:
+    '''
+    Detect the duplicated archives and per-conf results by the hashes of their contents, the first one is kept:
+    - the archives with the same bytes (e.g. one archive copied under several paths) are skipped before decoding
+    - the results of a conf which are the same as those of the same conf in an earlier archive of the same model, with
+      the same tag or, if untagged, the same work path (e.g. a conf run again with the same results) are dropped,
+      and an archive with only such results is skipped
+    The duplicates are reported when found, and counted in the summary.
+    The digests of the archives are kept in cache_dir if given, keyed by _archive_key(), so that an unchanged archive
+    is not read again only to be hashed.
+    '''
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir
+        self.archives = {}  # {digest of the bytes: path}
+        self.confs = {}     # {(tag or work path, conf): (digest of the results, path)}
+        self.skipped_archives = 0
+        self.skipped_confs = 0
+
+    def unique_paths(self, file_path_list: list) -> list:
+        unique = []
+        for path in file_path_list:
+            digest = self.digest(path)
+            if digest in self.archives:
+                print(f"Warning: archive {path} is the same as {self.archives[digest]}, skip it")
+                self.skipped_archives += 1
+            else:
+                self.archives[digest] = path
+                unique.append(path)
+        return unique
+
+    def digest(self, path: str) -> str:
+        key = _archive_key(path)
+        cache_file = None
+        if self.cache_dir:
+            cache_file = os.path.join(self.cache_dir, "digest-" + hashlib.sha1(key[0].encode()).hexdigest() + ".pkl")
+            try:
+                with open(cache_file, "rb") as f:
+                    cached = pickle.load(f)
+                if cached["key"] == key:
+                    return cached["digest"]
+            except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+                pass
+
+        digest = hashlib.sha1(read_json_bytes(path)).hexdigest()
+        if cache_file:
+            _dump_cache(cache_file, {"key": key, "digest": digest})
+        return digest
+
+    def apply(self, path: str, archive: tuple):
+        '''
+        Return the archive without the duplicated conf results, or None if all its conf results are duplicated.
+        Applying it to the same archive again gives the same result.
+        '''
+        if archive is None:
+            return None
+        workdir_id, data_dict = archive
+        # the untagged models are told apart by their work paths
+        model = data_dict.get("tag") or workdir_id
+        unique, duplicates = {}, {}
+        for conf, v in data_dict.items():
+            if not isinstance(v, dict):
+                unique[conf] = v
+                continue
+            digest = hashlib.sha1(json.dumps(v, sort_keys=True, default=str).encode()).hexdigest()
+            first = self.confs.setdefault((model, conf), (digest, path))
+            if first[0] == digest and first[1] != path:
+                duplicates[conf] = first[1]
+            else:
+                unique[conf] = v
+        if not duplicates:
+            return archive
+        if len(duplicates) == sum(isinstance(v, dict) for v in data_dict.values()):
+            print(f"Warning: all results of {path} are the same as those in {', '.join(sorted(set(duplicates.values())))}, skip it")
+            self.skipped_archives += 1
+            return None
+        for conf, first in duplicates.items():
+            print(f"Warning: results of {conf} in {path} are the same as those in {first}, skip them")
+        self.skipped_confs += len(duplicates)
+        return (workdir_id, unique)
+
+    def summary(self) -> str:
+        return f"{self.skipped_archives} duplicated archives and {self.skipped_confs} duplicated conf results are skipped"
+
+def load_archive(path: str, cache_dir: str = None, memo: dict = None, selection: Selection = None, decoder: str = None):
+    '''
+    Load one all_result.json archive, return (work_path, data) or None if it is not a valid archive
+    or it is not selected by selection. decoder is the name of the JSON decoder, see json_decoders().
+    '''
+    if selection:
+        if not selection.keep_path(path):
+            return None
+        archive = _decode_archive(path, cache_dir, memo, decoder)
+        return archive and selection.apply(path, archive)
+    return _decode_archive(path, cache_dir, memo, decoder)
+
+def _decode_archive(path: str, cache_dir: str = None, memo: dict = None, decoder: str = None):
+    '''
+    The decoded archive is kept in memo (shared by the datasets of one run) and in cache_dir (shared between runs),
+    both keyed by _archive_key(), so that an unchanged archive is decoded only once. The whole archive is kept,
+    so that the cache can be shared by different selections.
+    '''
+    key = _archive_key(path)
+    if memo is not None and key in memo:
+        return memo[key]
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, "archive-" + hashlib.sha1(key[0].encode()).hexdigest() + ".pkl")
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached["key"] == key:
+                if memo is not None:
+                    memo[key] = cached["archive"]
+                return cached["archive"]
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    data_dict = load_json(path, decoder)
+    try:
+        workdir_id = data_dict.pop('work_path')
+        _ = data_dict.pop('archive_key')
+    except KeyError:
+        print(f'Invalid json for result archive, will skip: {path}')
+        archive = None
+    else:
+        archive = (workdir_id, data_dict)
+
+    if memo is not None:
+        memo[key] = archive
+    if cache_file:
+        _dump_cache(cache_file, {"key": key, "archive": archive})
+    return archive
+
+def _decode_parallel(file_path_list: list, cache_dir: str, memo: dict, selection: Selection, decoder: str, jobs: int) -> dict:
+    # decode the archives by a pool of processes into memo, where load_archive() finds them
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import repeat
+
+    todo = {}
+    for path in file_path_list:
+        key = _archive_key(path)
+        if key not in memo and (not selection or selection.keep_path(path)):
+            todo[path] = key
+    if len(todo) > 1:
+        with ProcessPoolExecutor(min(jobs, len(todo))) as pool:
+            for key, archive in zip(todo.values(), pool.map(_decode_archive, todo, repeat(cache_dir), repeat(None), repeat(decoder))):
+                memo[key] = archive
+    return memo
+
+def _dump_cache(cache_file: str, obj):
+    # write to a temporary file first, so that a concurrent reader never sees a partial cache file
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+def _add_archive(all_data_dict: dict, archive: tuple, source: str):
+    # two archives may have the same work path, e.g. copied results, keep both of them
+    workdir_id, data_dict = archive
+    if workdir_id in all_data_dict:
+        n = 2
+        while f"{workdir_id}#{n}" in all_data_dict:
+            n += 1
+        print(f"Warning: work path {workdir_id} of {source} is used by another archive, rename it to {workdir_id}#{n}")
+        workdir_id = f"{workdir_id}#{n}"
+    all_data_dict[workdir_id] = data_dict
+
+@stage
+def load_dataset(file_path_list: list, cache_dir: str = None, memo: dict = None, selection: Selection = None, decoder: str = None, jobs: int = 1,
+                 dedup: Deduplicator = None) -> dict:
+    if dedup is not None:
+        file_path_list = dedup.unique_paths(file_path_list)
+    if jobs > 1:
+        memo = _decode_parallel(file_path_list, cache_dir, {} if memo is None else memo, selection, decoder, jobs)
     all_data_dict = {}
     for kk in file_path_list:
-        data_dict = loadfn(kk)
-        try:
-            workdir_id = data_dict.pop('work_path')
-            _ = data_dict.pop('archive_key')
-        except KeyError:
-            print(f'Invalid json for result archive, will skip: {kk}')
-            continue
+        archive = load_archive(kk, cache_dir, memo, selection, decoder)
+        if dedup is not None:
+            archive = dedup.apply(kk, archive)
+        if archive is not None:
+            _add_archive(all_data_dict, archive, kk)
+    return all_data_dict
+
+def _sniff_reference(path: str) -> bool:
+    # whether the archive may be a reference dataset, by its tag found in the raw text, without decoding it.
+    # Only the first SNIFF_BYTES bytes are read (and decompressed), the tag is written there with the work path
+    opener = ARCHIVE_OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    tags = re.findall(rb'"tag"\s*:\s*"([^"]*)"', head)
+    return any(t.decode(errors="replace") in REFERENCE_TAGS for t in tags)
+
+def _assign_idx(content_dict: dict, fixed: list):
+    # the idx given by prep_elastic_content()/prep_eos_content(): the fixed models first, then the others in order
+    idx = len(fixed) - 1
+    for k, row in content_dict.items():
+        if k in fixed:
+            row["idx"] = fixed.index(k)
         else:
-            all_data_dict[workdir_id] = data_dict
+            idx += 1
+            row["idx"] = idx
 
-    # simplify the work path key for all datasets
-    simplified_dataset = tag_dataset(all_data_dict)
+@stage
+def stream_dataset(file_path_list: list, cache_dir: str = None, selection: Selection = None, decoder: str = None,
+                   exclude_invalid: bool = False, derived: bool = False, properties: list = ("elastic", "eos"), dedup: Deduplicator = None) -> tuple:
+    '''
+    Compute the per-conf items of prep_elastic_dict() and prep_eos_dict() in two phases, so that at most the references
+    and one model archive are in memory:
+    1. the reference datasets (REFERENCE_TAGS) are loaded, they are found by the tags in the heads of the archives
+       (see _sniff_reference()), so that the model archives are not read in full in this phase
+    2. the other archives are loaded one by one, the rows of the model are computed against the references,
+       and the archive is released before the next one is loaded
+    With dedup, the archives are also hashed before phase 1 (see Deduplicator), the digests are kept in cache_dir.
+    The items are the same as the ones of prep_elastic_dict(tag_dataset(load_dataset(...))) except that the point groups
+    for the selection are taken from the references only.
+    Return (elastic_dict_list, eos_dict_list, dataset), dataset has the references and an empty dict for each model,
+    it gives the names of the models and the point groups, e.g. for ingest_db().
+    '''
+    if dedup is not None:
+        file_path_list = dedup.unique_paths(file_path_list)
 
-    elastic_dict_list = prep_elastic_dict(simplified_dataset)
-    eval_CV_elactic_inf = eval_CV_elastic(elastic_dict_list)
+    # phase 1: the references
+    refs = {}
+    keys = {}   # path: unique work path
+    tags = {}   # unique work path: tag
+    for path in file_path_list:
+        if not _sniff_reference(path):
+            continue
+        archive = load_archive(path, cache_dir, selection=selection, decoder=decoder)
+        if archive is None or archive[1].get("tag") not in REFERENCE_TAGS or archive[1]["tag"] in refs:
+            continue
+        if dedup is not None:
+            archive = dedup.apply(path, archive)
+        work_path, data = archive
+        keys[path] = _unique_key(keys.values(), work_path, path)
+        tags[keys[path]] = data["tag"]
+        refs[data["tag"]] = {ik: iv for ik, iv in data.items() if ik != "tag"}
+
+    point_groups = _point_groups(refs)
+    keep_conf = lambda conf: not (selection and selection.point_groups) or point_groups.get(conf) in selection.point_groups
+    ref_confs = set(conf for w in refs.values() for conf, v in w.items() if isinstance(v, dict) and keep_conf(conf))
+    ref_checks = check_elastic_tensors(refs, sorted(ref_confs), derived) if "elastic" in properties else {}
+
+    # phase 2: the models, one by one
+    elastic_rows, eos_rows, eos_volumes = {}, {}, {}   # {unique work path: {conf: row or volumes}}
+    all_confs = set(ref_confs)
+    for path in file_path_list:
+        if path in keys:
+            continue
+        archive = load_archive(path, cache_dir, selection=selection, decoder=decoder)
+        if dedup is not None:
+            archive = dedup.apply(path, archive)
+        if archive is None:
+            continue
+        work_path, data = archive
+        if data.get("tag") in REFERENCE_TAGS and data["tag"] not in refs:
+            print(f"Warning: the tag {data['tag']} of {path} is not in its first {SNIFF_BYTES} bytes, it is reported as a model, "
+                  "load it without --stream to compare the models with it")
+        key = keys[path] = _unique_key(keys.values(), work_path, path)
+        tags[key] = data.get("tag")
+        confs = sorted(conf for conf, v in data.items() if isinstance(v, dict) and keep_conf(conf))
+        all_confs.update(confs)
+
+        orig_dict = dict(refs)
+        orig_dict[key] = {ik: iv for ik, iv in data.items() if ik != "tag"}
+        del data, archive
+        if "elastic" in properties:
+            checks = dict(ref_checks)
+            checks.update(check_elastic_tensors({key: orig_dict[key]}, confs, derived))
+            elastic_rows[key] = {conf: prep_elastic_content(orig_dict, conf, checks, exclude_invalid, derived, [key])[key] for conf in confs}
+        if "eos" in properties:
+            eos_rows[key], eos_volumes[key] = {}, {}
+            for conf in confs:
+                volumes = {}
+                eos_rows[key][conf] = prep_eos_content(orig_dict, conf, volumes, [key])[key]
+                if key in volumes:
+                    eos_volumes[key][conf] = volumes[key]
+        del orig_dict
+
+    # the names of the datasets as tag_dataset() gives, in the order of the archives
+    ordered = [keys[path] for path in file_path_list if path in keys]
+    names = dict(zip(ordered, tag_dataset({key: {"tag": tags[key]} if tags[key] else {} for key in ordered}).keys()))
+    ref_names = {names[key]: tags[key] for key in ordered if tags[key] in refs and key not in elastic_rows and key not in eos_rows}
 
+    metrics = METRICS_LIST0 + DERIVED_METRICS if derived else METRICS_LIST0
+    elastic_dict_list, eos_dict_list = [], []
+    for conf in sorted(all_confs):
+        if "elastic" in properties:
+            ref_rows = prep_elastic_content(refs, conf, ref_checks, exclude_invalid, derived)
+            content = {}
+            for key in ordered:
+                name = names[key]
+                row = ref_rows.get(ref_names.get(name)) if name in ref_names else elastic_rows[key].get(conf)
+                if row is None:
+                    print(f"Elastic information of {conf} is not in {name}")
+                    row = {m: None for m in metrics}
+                content[name] = row
+            _assign_idx(content, ["Expt", "DFT(abacus)", "single-dai", "mace"])
+            elastic_dict_list.append(elastic_item(conf, content, derived))
+        if "eos" in properties:
+            ref_volumes = {}
+            ref_rows = prep_eos_content(refs, conf, ref_volumes)
+            content, volumes = {}, {}
+            for key in ordered:
+                name = names[key]
+                if name in ref_names:
+                    row = ref_rows.get(ref_names[name])
+                    if ref_names[name] in ref_volumes:
+                        volumes[name] = ref_volumes[ref_names[name]]
+                else:
+                    row = eos_rows[key].get(conf)
+                    if conf in eos_volumes[key]:
+                        volumes[name] = eos_volumes[key][conf]
+                    if row is None:
+                        print(f"Eos information of {conf} is not in {name}")
+                        row = {m: None for m in METRICS_LIST2}
+                if row is not None:
+                    content[name] = row
+            _assign_idx(content, ["DFT(abacus)", "single-dai", "mace"])
+            eos_dict_list.append(eos_item(conf, content, volumes))
+
+    dataset = {name: refs.get(ref_names.get(name), {}) for name in names.values()}
+    return elastic_dict_list, eos_dict_list, dataset
+
+def _unique_key(used, workdir_id: str, source: str) -> str:
+    # the same renaming of the duplicated work paths as _add_archive()
+    used = set(used)
+    if workdir_id in used:
+        n = 2
+        while f"{workdir_id}#{n}" in used:
+            n += 1
+        print(f"Warning: work path {workdir_id} of {source} is used by another archive, rename it to {workdir_id}#{n}")
+        workdir_id = f"{workdir_id}#{n}"
+    return workdir_id
+
+def prep_report(simplified_dataset: dict, axis: str = "conf") -> dict:
+    elastic_dict_list = prep_elastic_dict(simplified_dataset)
     eos_dict_list = prep_eos_dict(simplified_dataset)
-    eval_MAE_eos_inf = eval_MAE_eos(eos_dict_list)
-
-    abc_all_dict ={
-        "report": {
-            "content_introduction_head": [prep_head1("1. Introduction")],
-            "content_summary_head": [prep_head1("2. Summary")],
-            "content_summary_elastic": [eval_CV_elactic_inf],
-            "content_summary_eos": [eval_MAE_eos_inf],
-            "content_result_head_1": [prep_head1("3. Elastic results")],
+    return assemble_report(elastic_dict_list, eos_dict_list, axis=axis)
+
+def prep_eos_results(eos_dict_list: list) -> list:
+    # each eos table is followed by the eos curves of the conf
+    eos_colors = _model_colors(eos_dict_list)
+    eos_content_list = []
+    for item in eos_dict_list:
+        eos_content_list.append(item)
+        eos_content_list.append(prep_eos_plot(item, eos_colors))
+    return eos_content_list
+
+@stage
+def assemble_report(elastic_dict_list: list, eos_dict_list: list, elastic_results: list = None, eos_results: list = None, axis: str = "conf", top_n: int = None,
+                    elastic_summary: SummaryAccumulator = None, eos_summary: SummaryAccumulator = None, overview: str = None,
+                    group_by: dict = None) -> dict:
+    '''
+    Build the report sections from the per-conf elastic and eos items.
+    elastic_results/eos_results replace the items of the per-conf result sections, e.g. by the html rendered before.
+    axis: "conf" gives a table for each conf, "model" gives a table for each model (see pivot_by_model()), "both" gives both.
+    top_n: the number of the worst confs of each model listed in the summary, default is TOP_N_WORST
+    elastic_summary/eos_summary: the summaries accumulated before, e.g. merged from the shards (see merge_shards())
+    overview: add the heatmaps of all confs to the summary (see prep_overview()), the confs are sorted by overview
+    group_by: {title: {conf: [group, ...]}}, add the summaries of the groups of confs (see prep_group_summary())
+    '''
+    eval_CV_elactic_inf = eval_CV_elastic(elastic_dict_list, top_n, elastic_summary)
+    eval_MAE_eos_inf = eval_MAE_eos(eos_dict_list, top_n, eos_summary)
+
+    # plots are built from the metrics
+    cv_hist_inf = prep_cv_histograms(elastic_dict_list)
+    elastic_plot_inf = prep_elastic_plots(elastic_dict_list)
+    if elastic_results is None:
+        elastic_results = elastic_dict_list
+    if eos_results is None:
+        eos_results = prep_eos_results(eos_dict_list)
+
+    # the sections of a property are left out if it is not selected (see Selection)
+    number = 3
+    report_setting = {
+        "content_introduction_head": [prep_head1("1. Introduction")],
+        "content_summary_head": [prep_head1("2. Summary")],
+    }
+    if elastic_dict_list:
+        report_setting["content_summary_elastic"] = [eval_CV_elactic_inf, cv_hist_inf]
+    if eos_dict_list:
+        report_setting["content_summary_eos"] = [eval_MAE_eos_inf]
+    report_setting["content_summary_worst"] = prep_worst_confs(eval_CV_elactic_inf, eval_MAE_eos_inf)
+    if overview:
+        report_setting["content_summary_overview"] = prep_overview(elastic_dict_list, eos_dict_list, overview)
+    for igroup, (title, groups) in enumerate((group_by or {}).items()):
+        report_setting[f"content_summary_group_{igroup}"] = prep_group_summary(elastic_dict_list, eos_dict_list, groups, title)
+    if elastic_dict_list:
+        report_setting.update({
+            "content_result_head_1": [prep_head1(f"{number}. Elastic results")],
             "content_text_elastic": [prep_text_elastic()],
-            "content_result_elastic": elastic_dict_list,
-            "content_result_head_2": [prep_head1("4. Eos results")],
+            "content_plot_elastic": [elastic_plot_inf],
+            "content_result_elastic": elastic_results,
+        })
+        number += 1
+    if eos_dict_list:
+        report_setting.update({
+            "content_result_head_2": [prep_head1(f"{number}. Eos results")],
             "content_text_eos": [prep_text_eos()],
-            "content_result_eos": eos_dict_list
+            "content_result_eos": eos_results
+        })
+        number += 1
+
+    if axis in ["model", "both"]:
+        # the items give the columns, with the derived properties if they are computed
+        elastic_metrics = elastic_dict_list[0]["metrics"] if elastic_dict_list else METRICS_LIST0
+        elastic_criteria = elastic_dict_list[0]["criteria"] if elastic_dict_list else ELASTIC_CRITERIA
+        elastic_model_list = pivot_by_model(elastic_dict_list, elastic_metrics, elastic_criteria)
+        eos_model_list = pivot_by_model(eos_dict_list, METRICS_LIST2, EOS_CRITERIA)
+        if axis == "model":
+            if elastic_dict_list:
+                report_setting["content_result_elastic"] = elastic_model_list
+            if eos_dict_list:
+                report_setting["content_result_eos"] = eos_model_list
+        else:
+            if elastic_dict_list:
+                report_setting.update({
+                    "content_model_head_1": [prep_head1(f"{number}. Elastic results of each model")],
+                    "content_model_elastic": elastic_model_list,
+                })
+                number += 1
+            if eos_dict_list:
+                report_setting.update({
+                    "content_model_head_2": [prep_head1(f"{number}. Eos results of each model")],
+                    "content_model_eos": eos_model_list,
+                })
+
+    return report_setting
+
+def parse_shard(shard: str) -> tuple:
+    # "I/N" -> (I, N), I is from 1 to N
+    try:
+        i, n = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}', should be I/N")
+    if not 1 <= i <= n:
+        raise ValueError(f"Invalid shard '{shard}', I should be from 1 to N")
+    return (i, n)
+
+def write_shard(shard_file: str, shard: tuple, elastic_dict_list: list, eos_dict_list: list, top_n: int = None):
+    '''
+    Write the per-conf items and the summaries of one shard of the confs, to be merged by merge_shards().
+    The file is compressed by gzip if its name ends with .gz.
+    '''
+    shard_dict = {
+        "shard": list(shard),
+        "elastic": elastic_dict_list,
+        "eos": eos_dict_list,
+        "elastic_summary": accumulate_CV_elastic(elastic_dict_list, top_n).to_dict(),
+        "eos_summary": accumulate_MAE_eos(eos_dict_list, top_n).to_dict(),
+    }
+    raw = json.dumps(shard_dict, separators=(",", ":"), default=_json_default).encode()
+    with (gzip.open if shard_file.endswith(".gz") else open)(shard_file, "wb") as f:
+        f.write(raw)
+    print(f"shard {shard[0]}/{shard[1]} with {len(elastic_dict_list)} confs is written to {shard_file}")
+
+def _json_default(obj):
+    # the numpy scalars and arrays in the tables
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def merge_shards(shard_files: list) -> tuple:
+    '''
+    Merge the shards written by write_shard(), return (elastic_dict_list, eos_dict_list, elastic_summary, eos_summary).
+    The items are sorted by the confs as prep_elastic_dict() does, so the report is the same as the one of a single run.
+    '''
+    elastic_dict_list, eos_dict_list = [], []
+    elastic_summary = eos_summary = None
+    seen = {}
+    for shard_file in shard_files:
+        shard_dict = json.loads(read_json_bytes(shard_file))
+        i, n = shard_dict["shard"]
+        if (i, n) in seen:
+            print(f"Warning: shard {i}/{n} of {shard_file} is also given by {seen[(i, n)]}, it is skipped")
+            continue
+        seen[(i, n)] = shard_file
+        elastic_dict_list.extend(shard_dict["elastic"])
+        eos_dict_list.extend(shard_dict["eos"])
+        ielastic = SummaryAccumulator.from_dict(shard_dict["elastic_summary"])
+        ieos = SummaryAccumulator.from_dict(shard_dict["eos_summary"])
+        elastic_summary = ielastic if elastic_summary is None else elastic_summary.merge(ielastic)
+        eos_summary = ieos if eos_summary is None else eos_summary.merge(ieos)
+
+    for n in set(n for _, n in seen):
+        missing = [str(i) for i in range(1, n + 1) if (i, n) not in seen]
+        if missing:
+            print(f"Warning: shards {', '.join(missing)} of {n} are not given, the report only covers the other shards")
+    if len(set(n for _, n in seen)) > 1:
+        print("Warning: the shards are split in different numbers, some confs may be reported twice")
+
+    elastic_dict_list.sort(key=lambda item: item["title"])
+    eos_dict_list.sort(key=lambda item: item["title"])
+    return elastic_dict_list, eos_dict_list, elastic_summary, eos_summary
+
+@functools.lru_cache(maxsize=None)
+def _code_version() -> str:
+    # the digest of this file, the cached results computed by other versions of the code are not used
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def prep_round_summary(simplified_dataset: dict, exclude_invalid: bool = False) -> dict:
+    '''
+    The summary of one round of results: {model: {metric: value}} for the metrics in TREND_METRICS
+    '''
+    eval_CV_elactic_inf = eval_CV_elastic(prep_elastic_dict(simplified_dataset, exclude_invalid))
+    eval_MAE_eos_inf = eval_MAE_eos(prep_eos_dict(simplified_dataset))
+
+    summary = {}
+    for inf in [eval_CV_elactic_inf, eval_MAE_eos_inf]:
+        for k, v in inf["content"].items():
+            summary.setdefault(k, {}).update({m: v[m] for m in TREND_METRICS if m in v})
+    return summary
+
+def prep_trend_report(rounds: list, cache_dir: str = None, selection: Selection = None, decoder: str = None,
+                      exclude_invalid: bool = False, dedup: bool = False) -> dict:
+    '''
+    rounds: a list of (label, [glob1, glob2, ...]), in the order of time
+    exclude_invalid: see prep_elastic_content(); dedup: skip the duplicated archives and conf results of each round (see Deduplicator)
+    
+    The archives shared by consecutive rounds (e.g. the reference data) are decoded once. With cache_dir,
+    the decoded archives and the summary of each round are also cached on disk, so a round whose archives are
+    all unchanged is not recomputed in the later runs. The summaries are cached with the settings, the criteria
+    and the code they are computed by, see _code_version().
+    '''
+    import numpy as np
+    memo = {}
+    round_dict = {}
+    summaries = []
+    for iround, (label, patterns) in enumerate(rounds):
+        file_path_list = collect_paths(patterns)
+        keys = [_archive_key(p) for p in file_path_list]
+        round_dict[label] = {"idx": iround, "archives": len(file_path_list), "paths": " ".join(patterns)}
+
+        summary = None
+        cache_file = None
+        if cache_dir:
+            round_key = repr((keys, selection.key() if selection else "", decoder, exclude_invalid, dedup,
+                              ELASTIC_CRITERIA, EOS_CRITERIA, TREND_METRICS, _code_version()))
+            cache_file = os.path.join(cache_dir, "round-" + hashlib.sha1(round_key.encode()).hexdigest() + ".pkl")
+            try:
+                with open(cache_file, "rb") as f:
+                    summary = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                summary = None
+        if summary is None:
+            deduplicator = Deduplicator(cache_dir) if dedup else None
+            dataset = tag_dataset(load_dataset(file_path_list, cache_dir, memo, selection, decoder, dedup=deduplicator))
+            if deduplicator:
+                print(f"{label}: {deduplicator.summary()}")
+            summary = prep_round_summary(selection.select_point_groups(dataset) if selection else dataset, exclude_invalid)
+            if cache_file:
+                _dump_cache(cache_file, summary)
+        summaries.append((label, summary))
+
+        # only keep the archives of this round in memory for the next round
+        memo = {k: v for k, v in memo.items() if k in keys}
+
+    all_models_list = sorted(set(k for _, summary in summaries for k in summary.keys()))
+    labels = [label for label, _ in summaries]
+    colors = {k: PLOT_COLORS[i % len(PLOT_COLORS)] for i, k in enumerate(all_models_list)}
+
+    report_setting = {
+        "content_rounds_head": [prep_head1("1. Rounds")],
+        "content_rounds": [{
+            "type": "metrics",
+            "content": round_dict,
+            "sort": ["idx"],
+            "metrics": ["idx", "archives", "paths"],
+        }],
+    }
+    for imetric, (metric, criteria) in enumerate(TREND_METRICS.items()):
+        content_dict = {k: {label: summary.get(k, {}).get(metric) for label, summary in summaries} for k in all_models_list}
+        series = [(k, list(range(len(labels))), [np.nan if content_dict[k][label] is None else content_dict[k][label] for label in labels])
+                  for k in all_models_list]
+        report_setting[f"content_trend_{imetric}"] = [
+            prep_head1(f"{imetric + 2}. Trend of {metric}"),
+            {
+                "type": "metrics",
+                "content": content_dict,
+                "criteria": {label: criteria for label in labels},
+                "metrics": labels,
+            },
+            {
+                "type": "svg",
+                "content": svg_plot(series, title=metric, xlabel="Round", ylabel=metric, mode="line", colors=colors,
+                                    xticks=list(enumerate(labels))),
+            },
+        ]
+
+    return report_setting
+
+class DirWatcher:
+    '''
+    Wait for file changes in a set of directories, by inotify on Linux and by polling elsewhere.
+    Only the arrival of events is reported, the caller should rescan the files to find what has changed.
+    '''
+    # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    IN_MASK = 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        try:
+            import ctypes, ctypes.util
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            print(f"Warning: inotify is not available ({e}), the files will be polled.")
+
+    def add(self, directory):
+        if self.fd is None or directory in self.watched:
+            return
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_MASK) >= 0:
+            self.watched.add(directory)
+
+    def wait(self, timeout):
+        '''
+        Wait at most timeout seconds, return True if some events arrived
+        '''
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+def _watch_dirs(patterns: list) -> set:
+    # the existing directories which may hold the archives, and the fixed root of each pattern to notice new sub directories
+    dirs = set()
+    for pattern in patterns:
+        pattern = os.path.abspath(pattern)
+        root = pattern
+        while glob.has_magic(root):
+            root = os.path.dirname(root)
+        dirs.add(os.path.dirname(root) if root == pattern else root)
+        for d in glob.glob(os.path.dirname(pattern), recursive=True):
+            if os.path.isdir(d):
+                dirs.add(d)
+    return {d for d in dirs if os.path.isdir(d)}
+
+def _scan(patterns: list) -> dict:
+    snapshot = {}
+    for pattern in patterns:
+        for path in glob.glob(os.path.abspath(pattern), recursive=True):
+            try:
+                if os.path.isfile(path):
+                    snapshot[path] = _archive_key(path)
+            except OSError:
+                pass
+    return snapshot
+
+def _settle(watcher: DirWatcher, patterns: list, snapshot: dict, debounce: float) -> dict:
+    # wait until there is no event and the files are unchanged for debounce seconds, so a burst of writes is handled once
+    while True:
+        if watcher.wait(debounce):
+            continue
+        new_snapshot = _scan(patterns)
+        if new_snapshot == snapshot:
+            return snapshot
+        snapshot = new_snapshot
+
+def watch_report(patterns: list, options: dict, debounce: float = 2.0, poll_interval: float = 10.0, cache_dir: str = None, axis: str = "conf", selection: Selection = None, decoder: str = None,
+                 exclude_invalid: bool = False, derived: bool = False, top_n: int = None, overview: str = None, group_by: list = None, dedup: bool = False):
+    '''
+    Regenerate the report whenever the archives matching the patterns are created, changed or removed.
+    The dataset is kept in memory and only the archives that changed are loaded again. The per-conf tables are
+    rendered again only for the confs whose results changed in those archives, unless the models of the report have changed.
+    options: the other settings of Report(), e.g. bundle and compress
+    exclude_invalid, derived: see prep_elastic_content(); top_n, overview: see assemble_report(); group_by: see summary_groups()
+    dedup: skip the duplicated archives and conf results (see Deduplicator), they are detected again at each update
+    '''
+    # the report is rebuilt in the report context of the caller, e.g. with its precision and profiler
+    context = current_context()
+    watcher = DirWatcher()
+    archives = {}    # path: (work_path, data)
+    elastic_items = {}
+    eos_items = {}
+    fragments = {}   # (kind, conf): html
+    models = None
+    snapshot = {}
+
+    while True:
+        for d in _watch_dirs(patterns):
+            watcher.add(d)
+        current = _scan(patterns)
+        if current != snapshot:
+            current = _settle(watcher, patterns, current, debounce)
+            try:
+                dirty = set()
+                for path in set(snapshot) - set(current):
+                    old = archives.pop(path, None)
+                    if old:
+                        dirty.update(k for k, v in old[1].items() if isinstance(v, dict))
+                for path in current:
+                    if snapshot.get(path) == current[path]:
+                        continue
+                    try:
+                        new = load_archive(path, cache_dir, selection=selection, decoder=decoder)
+                    except Exception:
+                        traceback.print_exc()
+                        print(f"Error: load {path} failed, it will be loaded again when it is changed.")
+                        continue
+                    # only the confs whose results changed are computed and rendered again
+                    old_data = archives[path][1] if archives.get(path) else {}
+                    new_data = new[1] if new else {}
+                    dirty.update(k for k in set(old_data) | set(new_data)
+                                 if isinstance(old_data.get(k, new_data.get(k)), dict) and old_data.get(k) != new_data.get(k))
+                    archives[path] = new
+                snapshot = current
+
+                all_data_dict = {}
+                deduplicator = Deduplicator() if dedup else None
+                for path in sorted(archives):
+                    archive = deduplicator.apply(path, archives[path]) if deduplicator else archives[path]
+                    if archive:
+                        _add_archive(all_data_dict, archive, path)
+                if deduplicator:
+                    print(deduplicator.summary())
+                dataset = tag_dataset(all_data_dict)
+                if selection:
+                    dataset = selection.select_point_groups(dataset)
+                all_confs = set()
+                for w in dataset.values():
+                    all_confs.update(w.keys())
+                if set(dataset.keys()) != models:
+                    # the model labels and colors depend on all models, render everything again
+                    models = set(dataset.keys())
+                    dirty = set(all_confs)
+                    fragments.clear()
+                for conf in list(elastic_items):
+                    if conf not in all_confs:
+                        elastic_items.pop(conf)
+                        eos_items.pop(conf)
+                for conf in dirty & all_confs:
+                    elastic_items[conf] = prep_elastic_item(dataset, conf, None, exclude_invalid, derived)
+                    eos_items[conf] = prep_eos_item(dataset, conf)
+                    fragments.pop(("elastic", conf), None)
+                    fragments.pop(("eos", conf), None)
+
+                all_confs_list = sorted(all_confs)
+                elastic_dict_list = [elastic_items[conf] for conf in all_confs_list if not selection or selection.keep_property("elastic")]
+                eos_dict_list = [eos_items[conf] for conf in all_confs_list if not selection or selection.keep_property("eos")]
+                eos_colors = _model_colors(eos_dict_list)
+                rendered = 0
+                for conf in all_confs_list if axis != "model" else []:
+                    if ("elastic", conf) not in fragments:
+                        fragments[("elastic", conf)] = item2html(elastic_items[conf])
+                        fragments[("eos", conf)] = item2html(eos_items[conf]) + item2html(prep_eos_plot(eos_items[conf], eos_colors))
+                        rendered += 1
+                elastic_results = [{"type": "html", "content": fragments.get(("elastic", conf), "")} for conf in all_confs_list]
+                eos_results = [{"type": "html", "content": fragments.get(("eos", conf), "")} for conf in all_confs_list]
+
+                groups = summary_groups(all_confs_list, group_by, dataset)
+                # the assets (e.g. the images inlined by --bundle) may have changed since the last update
+                context.caches.clear()
+                Report(dict(options, report=assemble_report(elastic_dict_list, eos_dict_list, elastic_results, eos_results, axis, top_n,
+                                                            overview=overview, group_by=groups)), context)
+                print(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} report updated: {len(archives)} archives, {len(all_confs_list)} confs, {rendered} confs rendered")
+            except Exception:
+                traceback.print_exc()
+                print("Error: update the report failed, will try again when the archives are changed.")
+        watcher.wait(poll_interval)
+
+def serve_report(simplified_dataset: dict, host: str = "127.0.0.1", port: int = 8000, exclude_invalid: bool = False, derived: bool = False,
+                 top_n: int = None, overview: str = None, group_by: list = None, properties: list = ("elastic", "eos")):
+    '''
+    Serve the report by a local http server. The metrics of all confs are computed once at start, the summary page is
+    served immediately, and the table of a conf is rendered only when it is opened in the page. The rendered tables
+    are kept in a LRU cache of SERVER_CACHE_SIZE entries.
+    exclude_invalid, derived: see prep_elastic_content(); top_n, overview: see assemble_report(); group_by: see summary_groups()
+    properties: the properties served, the sections of the other properties are left out
+    
+    GET /                           the summary page
+    GET /fragment/elastic?conf=xxx  the elastic table of a conf
+    GET /fragment/eos?conf=xxx      the eos table and eos curves of a conf
+    GET /api/confs                  json list of the confs
+    GET /api/models                 json list of the models
+    GET /api/summary                json of the summary of elastic and eos
+    GET /api/elastic?conf=xxx       json of the elastic metrics of a conf
+    GET /api/eos?conf=xxx           json of the eos metrics of a conf
+    '''
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs, quote
+
+    # the settings of the report context (e.g. --precision) are also used by the threads rendering the fragments
+    context = current_context()
+    # a profiler follows the stages of one thread only
+    render_lock = threading.Lock() if context.profiler else contextlib.nullcontext()
+    elastic_dict_list = prep_elastic_dict(simplified_dataset, exclude_invalid, derived) if "elastic" in properties else []
+    eos_dict_list = prep_eos_dict(simplified_dataset) if "eos" in properties else []
+    items = {
+        "elastic": {item["title"]: item for item in elastic_dict_list},
+        "eos": {item["title"]: item for item in eos_dict_list},
+    }
+    eos_colors = _model_colors(eos_dict_list)
+
+    def placeholder(kind, conf):
+        return {
+            "type": "html",
+            "content": f'''\t<details class="lazy" data-src="/fragment/{kind}?conf={quote(conf)}"><summary class="tabletitle">{conf}</summary></details>\n''',
         }
+    report_setting = assemble_report(elastic_dict_list, eos_dict_list,
+                                     [placeholder("elastic", item["title"]) for item in elastic_dict_list],
+                                     [placeholder("eos", item["title"]) for item in eos_dict_list], top_n=top_n, overview=overview,
+                                     group_by=summary_groups([item["title"] for item in elastic_dict_list or eos_dict_list], group_by, simplified_dataset))
+    summary = {
+        "elastic": report_setting.get("content_summary_elastic", [{}])[0].get("content", {}),
+        "eos": report_setting.get("content_summary_eos", [{}])[0].get("content", {}),
     }
+    script = '''\t<script>
+    document.querySelectorAll("details.lazy").forEach(function(d) {
+        d.addEventListener("toggle", function() {
+            if (d.open && !d.dataset.loaded) {
+                d.dataset.loaded = "1";
+                fetch(d.dataset.src).then(function(r) {return r.text();}).then(function(t) {d.insertAdjacentHTML("beforeend", t);});
+            }
+        });
+    });
+    </script>
+'''
+    page = render_html(report_setting).replace("</body>", script + "</body>", 1).encode()
+
+    @functools.lru_cache(maxsize=SERVER_CACHE_SIZE)
+    def fragment(kind, conf):
+        # the conf is already shown as the title of the folded section
+        with render_lock:
+            _init(context)
+            html = item2html(dict(items[kind][conf], title=""))
+            if kind == "eos":
+                html += item2html(prep_eos_plot(items[kind][conf], eos_colors))
+        return html.encode()
+
+    class ReportHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            conf = parse_qs(url.query).get("conf", [""])[0]
+            kind = url.path.rsplit("/", 1)[-1]
+            if url.path in ["/", "/index.html"]:
+                self.reply(page, "text/html")
+            elif url.path.startswith("/fragment/") and conf in items.get(kind, {}):
+                self.reply(fragment(kind, conf), "text/html")
+            elif url.path == "/api/confs":
+                self.reply_json(sorted(items["elastic"].keys()))
+            elif url.path == "/api/models":
+                self.reply_json(sorted(simplified_dataset.keys()))
+            elif url.path == "/api/summary":
+                self.reply_json(summary)
+            elif url.path in ["/api/elastic", "/api/eos"] and conf in items[kind]:
+                self.reply_json(items[kind][conf]["content"])
+            else:
+                self.send_error(404)
+
+        def reply_json(self, obj):
+            self.reply(json.dumps(obj, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o)).encode(), "application/json")
+
+        def reply(self, body, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            if len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=5)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), ReportHandler)
+    print(f"Serving the report at http://{host}:{server.server_address[1]}/ , press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def _point_groups(simplified_dataset: dict) -> dict:
+    # the point group of each conf, taken from DFT(abacus) as cal_cij_CV() does, or from any other dataset
+    point_groups = {}
+    for k in ['DFT(abacus)'] + [k for k in simplified_dataset if k != 'DFT(abacus)']:
+        for conf, v in simplified_dataset.get(k, {}).items():
+            if conf in point_groups or not isinstance(v, dict):
+                continue
+            try:
+                point_groups[conf] = str(v["relaxation"]["structure_info"]["point_group_symbol"])
+            except (KeyError, TypeError):
+                pass
+    return point_groups
+
+def ingest_db(db_file: str, simplified_dataset: dict, elastic_dict_list: list, eos_dict_list: list):
+    '''
+    Write the per-(model, conf) metrics into the sqlite database db_file, one row for each metric:
+    metrics(model, conf, point_group, prop, metric, value, pass), pass is 1/0 for the metrics with criteria, else NULL.
+    The rows of the ingested models are replaced, the rows of other models are kept. The rows are keyed by the model
+    names (tags or labels, see tag_dataset()), so the rows of a renamed model are left under the old name, e.g. when
+    the label of an untagged work path changes as other archives are added. Write a new database in that case.
+    '''
+    import sqlite3
+
+    point_groups = _point_groups(simplified_dataset)
+    rows = []
+    for prop, content, criteria in [("elastic", elastic_dict_list, ELASTIC_CRITERIA), ("eos", eos_dict_list, EOS_CRITERIA)]:
+        for item in content:
+            conf = item["title"]
+            criteria = item.get("criteria", criteria)
+            for k, v in item["content"].items():
+                for metric, value in v.items():
+                    if metric == "idx" or not isinstance(value, numbers.Real):
+                        continue
+                    metric_pass = judge_metric(value, criteria[metric]) if metric in criteria else None
+                    rows.append((k, conf, point_groups.get(conf), prop, metric, float(value), None if metric_pass is None else int(metric_pass)))
+
+    with sqlite3.connect(db_file) as db:
+        db.executescript(DB_SCHEMA)
+        others = sorted(m for (m,) in db.execute("SELECT DISTINCT model FROM metrics") if m not in simplified_dataset)
+        if others:
+            print(f"Warning: the rows of {', '.join(others)} in {db_file} are kept, write a new database if they are the old names of the models ingested now")
+        db.executemany("DELETE FROM metrics WHERE model = ?", [(k,) for k in simplified_dataset.keys()])
+        db.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    print(f"{len(rows)} metrics of {len(simplified_dataset)} models are written to {db_file}")
+
+def query_db(db_file: str, sql: str, params=()) -> Table:
+    import sqlite3
+    import pathlib
+
+    # the path is quoted in the uri, e.g. a "?" or "#" in it
+    with sqlite3.connect(pathlib.Path(db_file).absolute().as_uri() + "?mode=ro", uri=True) as db:
+        cursor = db.execute(sql, params)
+        header = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+    return Table(header, [list(c) for c in zip(*rows)] if rows else [[] for _ in header])
+
+def rescore_db(db_file: str, criteria: dict) -> Table:
+    '''
+    Judge the metrics in db_file again by criteria {metric: expr}, return the pass number of each model and metric
+    '''
+    import sqlite3
+
+    with sqlite3.connect(db_file) as db:
+        db.create_function("judge_metric", 2, lambda x, c: None if (p := judge_metric(x, c)) is None else int(p), deterministic=True)
+        db.execute("UPDATE metrics SET pass = NULL")
+        db.executemany("UPDATE metrics SET pass = judge_metric(value, ?) WHERE metric = ?", [(c, m) for m, c in criteria.items()])
+    return query_db(db_file, "SELECT metric, model, SUM(pass) AS pass_num, COUNT(pass) AS num FROM metrics "
+                             "WHERE pass IS NOT NULL GROUP BY metric, model ORDER BY metric, model")
+
+def export_db(db_file: str, output: str, fmt: str = "csv", sql: str = "SELECT * FROM metrics"):
+    import csv
+
+    table = query_db(db_file, sql)
+    f = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        if fmt == "json":
+            json.dump([dict(zip(table.header, row)) for row in table.rows()], f, indent=1)
+            f.write("\n")
+        else:
+            writer = csv.writer(f)
+            writer.writerow(table.header)
+            writer.writerows(table.rows())
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    if output != "-":
+        print(f"{table.nrows} rows are exported to {output}")
+
+def sql_worst(metric: str, model: str = None, limit: int = 20) -> tuple:
+    # the confs with the largest value of metric, for one model or for all models except the references
+    sql = "SELECT model, conf, point_group, value FROM metrics WHERE metric = ? AND value IS NOT NULL"
+    params = [metric]
+    if model:
+        sql += " AND model = ?"
+        params.append(model)
+    else:
+        sql += " AND model NOT IN ('Expt', 'DFT(abacus)')"
+    sql += " ORDER BY value DESC LIMIT ?"
+    return sql, params + [limit]
+
+def sql_fail_all(metric: str) -> tuple:
+    # the confs that no model (except the references) passes the criteria of metric
+    sql = """SELECT conf, point_group, COUNT(*) AS models, MIN(value) AS best_value FROM metrics
+        WHERE metric = ? AND model NOT IN ('Expt', 'DFT(abacus)') AND pass IS NOT NULL
+        GROUP BY conf HAVING MAX(pass) = 0 ORDER BY conf"""
+    return sql, [metric]
+
+def query2html(query_set):
+    '''
+    Render the result of a sql query on the results database as a table
+    {
+        "type": "query",
+        "content": "SELECT ...",
+        "params": [...],
+        "db": "results.db",
+        "title": "...",
+        "criteria": {...}
+    }
+    '''
+    title = query_set.get("title","")
+    center = query_set.get("center",True)
+    try:
+        table = query_db(query_set.get("db",""), query_set.get("content",""), query_set.get("params",()))
+    except Exception as e:
+        print(f"Error: query {query_set.get('content','')} failed: {e}")
+        return ""
+    table, _ = format_table(table, None, None, query_set.get("criteria",{}))
+
+    html = ""
+    if title:
+        html += f'''\t<div class="tabletitle">{title}</div>\n'''
+    if table.nrows == 0:
+        html += '''\t<div class="doc">None</div>\n'''
+    else:
+        html += _table2html(table,has_head=True)
+    if center:
+        html = "\t<center>\n" + html + "\t</center>\n"
+    return html
+
+def prep_query_sections(db_file: str, number: int) -> dict:
+    # the sections of the report driven by the queries on the results database
+    items = [prep_head1(f"{number}. Investigations")]
+    for metric in ["CV_DFT", "MAE_DFT"]:
+        sql, params = sql_fail_all(metric)
+        items.append({
+            "type": "query",
+            "title": f"Confs that fail the criteria of {metric} for every model",
+            "content": sql,
+            "params": params,
+            "db": db_file,
+        })
+    return {"content_query": items}
+
+def QueryArgs(parser):
+    parser.description = "Query the results database written by --db"
+    parser.add_argument('db', type=str, help='the sqlite database')
+    parser.add_argument('--worst', type=str, default=None, metavar='METRIC', help='list the confs with the largest value of METRIC, e.g. CV_DFT')
+    parser.add_argument('--model', type=str, default=None, help='only list the confs of this model for --worst')
+    parser.add_argument('--limit', type=int, default=20, help='the number of confs listed by --worst, default is 20')
+    parser.add_argument('--fail-all', type=str, default=None, metavar='METRIC', help='list the confs that fail the criteria of METRIC for every model, e.g. MAE_DFT')
+    parser.add_argument('--sql', type=str, default=None, help='run a sql query')
+    return parser
+
+def query_main(args):
+    if args.worst:
+        sql, params = sql_worst(args.worst, args.model, args.limit)
+    elif args.fail_all:
+        sql, params = sql_fail_all(args.fail_all)
+    elif args.sql:
+        sql, params = args.sql, []
+    else:
+        print("Error: one of --worst, --fail-all and --sql should be given!")
+        sys.exit(1)
+
+    print_table(query_db(args.db, sql, params))
+
+def rescore_main(args):
+    criteria = dict(ELASTIC_CRITERIA, **DERIVED_CRITERIA, **EOS_CRITERIA)
+    for arg in args.criteria or []:
+        metric, sep, expr = arg.partition("=")
+        if not sep or not metric or not expr:
+            raise ValueError(f"Invalid criteria '{arg}', should be METRIC=EXPR")
+        criteria[metric] = expr
+    print_table(rescore_db(args.db, criteria))
+
+def export_main(args):
+    fmt = args.format or ("json" if args.output.endswith(".json") else "csv")
+    export_db(args.db, args.output, fmt, args.sql)
+
+def print_table(table: Table):
+    widths = [max([len(str(h))] + [len(output_float(v)) for v in table.column(j)]) for j, h in enumerate(table.header)]
+    for row in [table.header] + [[output_float(v) for v in r] for r in table.rows()]:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip())
+
+def BenchArgs(parser):
+    parser.description = "Compare the JSON decoders on the all_result.json archives"
+    parser.add_argument('paths', type=str, nargs='+', help='the all_result.json files, glob patterns are supported, compressed files (.gz, .xz, .bz2) are read transparently')
+    parser.add_argument('--repeat', type=int, default=3, help='the best time of REPEAT runs is taken, default is 3')
+    return parser
+
+def render_main(args):
+    with open(args.param) as f:
+        all_dict = json.load(f)
+    Report(dict(all_dict, output=args.output or all_dict.get("output", "results.html")))
+
+def bench_main(args):
+    print_table(bench_decoders(collect_paths(args.paths), args.repeat))
+
+def parse_rounds(trend_args: list) -> list:
+    '''
+    Parse the LABEL=GLOB arguments of --trend into [(label, [glob, ...])], the globs of a repeated label are merged
+    '''
+    rounds = {}
+    for arg in trend_args:
+        label, sep, pattern = arg.partition("=")
+        if not sep or not label or not pattern:
+            raise ValueError(f"Invalid round '{arg}', should be LABEL=GLOB")
+        rounds.setdefault(label, []).append(pattern)
+    return list(rounds.items())
+
+def prep_dataset_items(file_path_list: list, args, selection: Selection) -> tuple:
+    '''
+    Load the archives and compute the per-conf items, return (elastic_dict_list, eos_dict_list, simplified_dataset)
+    '''
+    properties = [p for p in ["elastic", "eos"] if selection.keep_property(p)]
+    dedup = Deduplicator(args.cache) if args.dedup else None
+    if args.stream:
+        items = stream_dataset(file_path_list, args.cache, selection, args.decoder, args.exclude_invalid, args.derived, properties, dedup)
+        if dedup is not None:
+            print(dedup.summary())
+        return items
+
+    all_data_dict = load_dataset(file_path_list, args.cache, selection=selection, decoder=args.decoder, jobs=args.jobs, dedup=dedup)
+    if dedup is not None:
+        print(dedup.summary())
+
+    # simplify the work path key for all datasets
+    simplified_dataset = selection.select_point_groups(tag_dataset(all_data_dict))
+    elastic_dict_list = prep_elastic_dict(simplified_dataset, args.exclude_invalid, args.derived) if "elastic" in properties else []
+    eos_dict_list = prep_eos_dict(simplified_dataset) if "eos" in properties else []
+    return elastic_dict_list, eos_dict_list, simplified_dataset
+
+def ingest_main(args):
+    if not args.paths:
+        raise RuntimeError('No all_result.json is indicated, please give the paths to ingest.')
+    selection = selection_from_args(args)
+    elastic_dict_list, eos_dict_list, simplified_dataset = prep_dataset_items(collect_paths(args.paths), args, selection)
+    ingest_db(args.db, simplified_dataset, elastic_dict_list, eos_dict_list)
+
+def check_mode_options(mode: str, options: dict):
+    # options: {option: value}, the options given (with a true value) cannot be used in mode
+    given = [option for option, value in options.items() if value]
+    if given:
+        raise RuntimeError(f"{', '.join(given)} cannot be used with {mode}.")
+
+def report_main(args):
+    selection = selection_from_args(args)
+    options = {"bundle": "full" if args.bundle and args.bundle_full else args.bundle, "compress": args.compress, "output": args.output or "results.html",
+               "version": args.report_version, "precision": parse_precision(args.precision), "thumbnails": args.thumbnails}
+    # the stages of loading and computing are timed (and profiled) in the same context as the rendering
+    context = _init(ReportContext(version=options["version"], thumbnails=options["thumbnails"], precision=options["precision"],
+                                  profiler=StageProfiler() if args.profile else None))
+
+    if args.watch:
+        if not args.paths:
+            raise RuntimeError('No all_result.json is indicated, please give the paths to watch.')
+        check_mode_options("--watch", {"--db": args.db, "--stream": args.stream, "--jobs": args.jobs > 1, "--shard": args.shard, "--trend": args.trend,
+                                       "--serve": args.serve})
+        try:
+            watch_report(args.paths, options, args.debounce, args.poll, args.cache, args.axis, selection, args.decoder,
+                         args.exclude_invalid, args.derived, args.top, args.overview, args.group_by, args.dedup)
+        except KeyboardInterrupt:
+            pass
+        if context.profiler:
+            context.profiler.dump(args.profile)
+        return
+
+    if args.serve:
+        if not args.paths:
+            raise RuntimeError('No all_result.json is indicated, please give the paths to serve.')
+        check_mode_options("--serve", {"--db": args.db, "--stream": args.stream, "--bundle": args.bundle, "--compress": args.compress,
+                                       "--axis": args.axis != "conf", "--shard": args.shard, "--trend": args.trend})
+        host, _, port = args.serve.rpartition(":")
+        dedup = Deduplicator(args.cache) if args.dedup else None
+        dataset = selection.select_point_groups(tag_dataset(load_dataset(collect_paths(args.paths), args.cache, selection=selection, decoder=args.decoder, jobs=args.jobs, dedup=dedup)))
+        serve_report(dataset, host or "127.0.0.1", int(port), args.exclude_invalid, args.derived, args.top, args.overview, args.group_by,
+                     [p for p in ["elastic", "eos"] if selection.keep_property(p)])
+        if context.profiler:
+            context.profiler.dump(args.profile)
+        return
+
+    if args.trend:
+        check_mode_options("--trend", {"--derived": args.derived, "--stream": args.stream, "--db": args.db, "--shard": args.shard})
+        report_setting = prep_trend_report(parse_rounds(args.trend), args.cache, selection, args.decoder, args.exclude_invalid, args.dedup)
+    elif args.paths:
+        elastic_dict_list, eos_dict_list, simplified_dataset = prep_dataset_items(collect_paths(args.paths), args, selection)
+        if selection.shard:
+            i, n = selection.shard
+            write_shard(args.output or f"shard-{i}-of-{n}.json.gz", selection.shard, elastic_dict_list, eos_dict_list, args.top)
+            if context.profiler:
+                context.profiler.dump(args.profile)
+            return
+        group_by = summary_groups([item["title"] for item in elastic_dict_list or eos_dict_list], args.group_by, simplified_dataset)
+        report_setting = assemble_report(elastic_dict_list, eos_dict_list, axis=args.axis, top_n=args.top, overview=args.overview, group_by=group_by)
+        if args.db:
+            ingest_db(args.db, simplified_dataset, elastic_dict_list, eos_dict_list)
+            number = sum(1 for items in report_setting.values() for item in items if item.get("type") == "head1") + 1
+            report_setting.update(prep_query_sections(args.db, number))
+    else:
+        raise RuntimeError('No all_result.json is indicated, please give the paths or --trend rounds.')
+
+    abc_all_dict = dict(options, report=report_setting)
 
     # dumpfn(abc_all_dict, "abc_all_dict.json", indent = 4)
 
-    Report(abc_all_dict)
+    Report(abc_all_dict, context)
+    if context.profiler:
+        context.profiler.dump(args.profile)
+
+def merge_main(args):
+    elastic_dict_list, eos_dict_list, elastic_summary, eos_summary = merge_shards(collect_paths(args.shards))
+    report_setting = assemble_report(elastic_dict_list, eos_dict_list, axis=args.axis, overview=args.overview,
+                                     elastic_summary=elastic_summary, eos_summary=eos_summary)
+    Report({"report": report_setting, "bundle": "full" if args.bundle and args.bundle_full else args.bundle, "compress": args.compress,
+            "output": args.output, "precision": parse_precision(args.precision), "thumbnails": args.thumbnails})
 
-METRICS_LIST0 = ["idx", "c11", "c12", "c13", "c33", "c44", "c66", "BV", "GV", "RE_BV_Expt", "RE_BV_DFT", "RE_GV_Expt", "RE_GV_DFT", "CV_Expt", "CV_DFT"]
-METRICS_LIST1 = ["idx", "CV_Expt/DFT_pass_num", "CV_DFT_pass_num", "Aver_CV_Expt/DFT", "Aver_CV_DFT"]
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = CliArgs(argparse.ArgumentParser(prog="report_apex_html.py"))
+    # keep the command lines without subcommand working, they are taken as the report subcommand
+    if argv[:1] not in [[name] for name in SUBCOMMANDS] + [["-h"], ["--help"]]:
+        argv = ["report"] + argv
+    args = parser.parse_args(argv)
+    args.func(args)
+
+METRICS_LIST0 = ["idx", "c11", "c12", "c13", "c33", "c44", "c66", "BV", "GV", "RE_BV_Expt", "RE_BV_DFT", "RE_GV_Expt", "RE_GV_DFT", "CV_Expt", "CV_DFT", "valid"]
+METRICS_LIST1 = ["idx", "CV_Expt/DFT_pass_num", "CV_DFT_pass_num", "Aver_CV_Expt/DFT", "Aver_CV_DFT", "invalid_num"]
 METRICS_LIST2 = ["idx", "eos1", "eos2", "eos3", "eos4", "eos5", "eos6", "eos7", "eos8", "eos9", "eos10", "eos11", "eos12", "eos13", "eos14", "eos15", "eos16", "MAE_DFT"]
 METRICS_LIST3 = ["idx", "MAE_DFT_pass_num", "Aver_MAE_DFT"]
+
+ELASTIC_CRITERIA = {
+    "RE_BV_Expt": "abs(x) < 0.2",
+    "RE_GV_Expt": "abs(x) < 0.2",
+    "RE_BV_DFT": "abs(x) < 0.2",
+    "RE_GV_DFT": "abs(x) < 0.2",
+    "CV_Expt": "abs(x) < 0.2",
+    "CV_DFT": "abs(x) < 0.2",
+    "valid": "x == 1",
+}
+DERIVED_RE = ["BR", "GR", "BH", "GH", "E", "nu"]  # the derived properties compared with Expt and DFT(abacus)
+DERIVED_PROPERTIES = ["BR", "GR", "BH", "GH", "E", "nu", "AU"]
+DERIVED_METRICS = DERIVED_PROPERTIES + [f"RE_{p}_{ref}" for p in DERIVED_RE for ref in ["Expt", "DFT"]]
+DERIVED_CRITERIA = {f"RE_{p}_{ref}": "abs(x) < 0.2" for p in DERIVED_RE for ref in ["Expt", "DFT"]}
+
+EOS_CRITERIA = {
+    "MAE_DFT": "abs(x) < 0.1",
+}
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (model TEXT NOT NULL, conf TEXT NOT NULL, point_group TEXT, prop TEXT NOT NULL, metric TEXT NOT NULL, value REAL, pass INTEGER);
+CREATE INDEX IF NOT EXISTS metrics_model ON metrics (model, metric, value);
+CREATE INDEX IF NOT EXISTS metrics_conf ON metrics (conf, prop);
+CREATE INDEX IF NOT EXISTS metrics_point_group ON metrics (point_group, metric);
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, value);
+"""
+
+ARCHIVE_OPENERS = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open}  # suffix: opener of the compressed archives
+
+SUBCOMMANDS = ["report", "merge", "ingest", "rescore", "query", "export", "bench", "render"]
+
+TENSOR_SYMMETRY_TOL = 1e-3  # an elastic tensor is asymmetric if |Cij - Cji| > TENSOR_SYMMETRY_TOL * max|Cij|
+
+GROUP_METRICS = ["CV_Expt/DFT_pass_num", "CV_DFT_pass_num", "Aver_CV_Expt/DFT", "Aver_CV_DFT", "MAE_DFT_pass_num", "Aver_MAE_DFT"]
+FORMULA_RE = re.compile(r"(?:[A-Z][a-z]?\d*(?:\.\d+)?)+")  # a conf path component such as Al, AlCu or Al2O3
+ELEMENTS = set("""H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr
+    Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os
+    Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc
+    Lv Ts Og""".split())  # the element symbols in the formulas of the conf paths
+
+REFERENCE_TAGS = ["Expt", "DFT(abacus)"]  # the reference datasets, the models are compared with them
+SNIFF_BYTES = 1 << 16  # the bytes at the head of an archive searched for the tag of a reference dataset
+
+TOP_N_WORST = 10  # number of the worst confs of each model listed in the summary
+
+TREND_METRICS = {"Aver_CV_Expt/DFT": "abs(x) < 0.2", "Aver_CV_DFT": "abs(x) < 0.2", "Aver_MAE_DFT": "abs(x) < 0.1"}  # metric: criteria of the trend report
+
+SERVER_CACHE_SIZE = 512  # number of rendered per-conf tables kept by the report server
+
+HEAT_COLORS = [(44, 160, 44), (255, 221, 87), (214, 39, 40)]  # the colors of 0, the threshold and twice the threshold in the heatmaps
+HEAT_NAN_COLOR = (225, 225, 225)
+HEATMAP_MAX_ROWS = 1200   # more confs are merged into blocks, each row of the heatmap is the worst of a block
+HEATMAP_LABEL_ROWS = 60   # the conf names are shown in the heatmaps of at most this number of confs
+TABLE_MAX_ROWS = 1000  # a csv table of more rows is shown by its first and last rows, with a link to the csv file, 0 to show all rows
+TABLE_TAIL_ROWS = 20   # the number of the last rows shown for such a table
+PROFILE_TOP_ALLOCATIONS = 20    # number of the top allocations of each stage in allocations.txt
+PROFILE_MAX_DEPTH = 128         # the collapsed stacks are cut at this depth
+THUMBNAIL_SIZE = (600, 600)  # the largest width and height of the thumbnails of the images, as the images are shown in the report
+PLOT_SIZE = (320, 280)  # width and height of the svg plots in pixel
+PLOT_MAX_POINTS = 2000  # the scatter of a parity plot is decimated to at most this number of points
+PLOT_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
     
 if __name__ == "__main__":
     main()
\ No newline at end of file